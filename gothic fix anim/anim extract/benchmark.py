@@ -0,0 +1,373 @@
+import ctypes
+import enum
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+import numpy as np
+
+# main.py needs mathutils: pip install mathutils, or pip install bpy - mathutils is there after import of bpy
+try:
+    import mathutils
+except ImportError:
+    import bpy
+
+
+def install_zenkit_stub():
+    # fixtures below replace all zenkit objects main.py use, stub is only for import of main.py
+    zenkit = types.ModuleType('zenkit')
+    zenkit.Vfs = type('Vfs', (), {})
+    zenkit.VfsOverwriteBehavior = enum.Enum('VfsOverwriteBehavior', 'NONE ALL NEWER OLDER')
+    for name in ('ModelAnimation', 'ModelHierarchy', 'ModelMesh'):
+        setattr(zenkit, name, type(name, (), {}))
+    sys.modules['zenkit'] = zenkit
+
+
+# zenkit native library is not needed and can fail to load (OSError)
+try:
+    import zenkit
+except (ImportError, OSError):
+    install_zenkit_stub()
+
+import main
+
+
+# synthetic archive, sizes like Gothic humans/monsters skeletons and .ASC
+SEED = 1
+SKELETONS = {'HUMANS': 62, 'BLOODFLY': 26}  # skeleton name: bone count
+ASC_PER_SKELETON = 8
+MAN_PER_ASC = 3
+FRAMES_PER_MAN = 40
+FPS_SOURCE = 25.0
+FPS_RESAMPLE = 10.0  # every second .ASC has FPS:10 in source script, resampled in save_asc
+
+REPEAT = 5
+RESULT_FILE = 'benchmark_results.json'
+
+PATH_TO_IMPORTER = Path(__file__).resolve().parent.parent / 'import_manjson_ascjson_animation' / '__init__.py'
+
+
+# objects shaped like zenkit ones, only what main.py use
+class Vec3f(ctypes.Structure):
+    _fields_ = [('x', ctypes.c_float), ('y', ctypes.c_float), ('z', ctypes.c_float)]
+
+
+class Vec4f(ctypes.Structure):
+    _fields_ = [('x', ctypes.c_float), ('y', ctypes.c_float), ('z', ctypes.c_float), ('w', ctypes.c_float)]
+
+
+class Quat(ctypes.Structure):
+    _fields_ = [('w', ctypes.c_float), ('x', ctypes.c_float), ('y', ctypes.c_float), ('z', ctypes.c_float)]
+
+
+class AnimationSample(ctypes.Structure):
+    _fields_ = [('position', Vec3f), ('rotation', Quat)]
+
+
+class Mat4x4(ctypes.Structure):
+    _fields_ = [('columns', Vec4f * 4)]
+
+
+class AxisAlignedBoundingBox:
+    def __init__(self, bbox_min, bbox_max):
+        self.min = Vec3f(*bbox_min)
+        self.max = Vec3f(*bbox_max)
+
+
+class ModelHierarchyNode:
+    def __init__(self, name, parent, transform):
+        self.name = name
+        self.parent = parent
+        self.transform = transform
+
+
+class ModelHierarchy:
+    def __init__(self, checksum, source_path, nodes):
+        self.checksum = checksum
+        self.source_path = source_path
+        self.source_date = None
+        self.bbox = AxisAlignedBoundingBox([-50.0, -90.0, -50.0], [50.0, 90.0, 50.0])
+        self.collision_bbox = AxisAlignedBoundingBox([-30.0, -90.0, -30.0], [30.0, 90.0, 30.0])
+        self.root_translation = Vec3f(0.0, 90.0, 0.0)
+        self.nodes = nodes
+
+
+class ModelAnimation:
+    def __init__(self, checksum, source_path, source_script, fps, node_indices, sample_values):
+        self.checksum = checksum
+        self.source_path = source_path
+        self.source_script = source_script
+        self.frame_count = len(sample_values) // len(node_indices)
+        self.fps = fps
+        self.fps_source = FPS_SOURCE
+        self.layer = 1
+        self.node_count = len(node_indices)
+        self.node_indices = node_indices
+        self._sample_values = sample_values
+
+    @property
+    def samples(self):
+        # zenkit build new list of samples on every access
+        return [AnimationSample(Vec3f(*values[0:3]), Quat(*values[3:7])) for values in self._sample_values]
+
+
+def random_quaternion(rng):
+    values = [rng.uniform(-1.0, 1.0) for _ in range(4)]
+    length = math.sqrt(sum(value * value for value in values))
+    return [value / length for value in values]
+
+
+def create_model_hierarchy(rng, skeleton_name, checksum, bone_count):
+    nodes = []
+    for i in range(bone_count):
+        if i == 0:
+            name = 'BIP01'
+        elif i < bone_count - 4:
+            name = f'BIP01 B{i}'
+        else:
+            name = f'ZS_SLOT{i}'
+        parent = rng.randrange(0, i) if i > 0 else -1
+
+        # rotation matrix of random quaternion with translation in last column
+        w, x, y, z = random_quaternion(rng)
+        transform = Mat4x4()
+        transform.columns[0] = Vec4f(1 - 2 * (y * y + z * z), 2 * (x * y + z * w), 2 * (x * z - y * w), 0.0)
+        transform.columns[1] = Vec4f(2 * (x * y - z * w), 1 - 2 * (x * x + z * z), 2 * (y * z + x * w), 0.0)
+        transform.columns[2] = Vec4f(2 * (x * z + y * w), 2 * (y * z - x * w), 1 - 2 * (x * x + y * y), 0.0)
+        transform.columns[3] = Vec4f(rng.uniform(-20.0, 20.0), rng.uniform(-20.0, 20.0), rng.uniform(-20.0, 20.0), 1.0)
+
+        nodes.append(ModelHierarchyNode(name, parent, transform))
+
+    return ModelHierarchy(checksum, f'\\_WORK\\DATA\\ANIMS\\{skeleton_name}.ASC', nodes)
+
+
+def create_sample_values(rng, frame_count, bone_count):
+    # smooth tracks: every bone moves and turns with own phase, frame by frame, bone by bone in frame
+    phases = [rng.uniform(0.0, math.pi) for _ in range(bone_count)]
+    sample_values = []
+    for frame in range(frame_count):
+        for bone_index in range(bone_count):
+            angle = math.sin(frame * 0.2 + phases[bone_index])
+            sample_values.append([angle * 10.0, 90.0 + angle * 5.0, angle * 2.0,
+                                  math.cos(angle / 2.0), math.sin(angle / 2.0), 0.0, 0.0])
+
+    return sample_values
+
+
+def create_archive():
+    # -> [model_hierarchy, ...], [(animation_name, model_animation), ...]
+    rng = random.Random(SEED)
+
+    model_hierarchies = []
+    model_animations = []
+    for checksum, (skeleton_name, bone_count) in enumerate(SKELETONS.items(), start=1):
+        model_hierarchies.append(create_model_hierarchy(rng, skeleton_name, checksum, bone_count))
+
+        node_indices = list(range(bone_count))
+        for asc_index in range(ASC_PER_SKELETON):
+            asc_name = f'{skeleton_name[:3]}_BENCH_M{asc_index:02}'
+            fps = FPS_RESAMPLE if asc_index % 2 else FPS_SOURCE
+            for man_index in range(MAN_PER_ASC):
+                man_name = f'S_BENCH_{asc_index:02}_{man_index}'
+                start_frame = man_index * FRAMES_PER_MAN
+                end_frame = start_frame + FRAMES_PER_MAN - 1
+                source_script = (f'ANI ("{man_name}" 1 "{man_name}" 0.0 0.1 M. "{asc_name}.ASC" F '
+                                 f'{start_frame} {end_frame} FPS:{fps:g})')
+                sample_values = create_sample_values(rng, FRAMES_PER_MAN, bone_count)
+                model_animation = ModelAnimation(checksum, f'\\_WORK\\DATA\\ANIMS\\{asc_name}.ASC', source_script, fps,
+                                                 node_indices, sample_values)
+                model_animations.append((f'{skeleton_name}-{man_name}', model_animation))
+
+    return model_hierarchies, model_animations
+
+
+def clear_main_data():
+    main.model_hierarchy_data.clear()
+    main.model_animation_data.clear()
+    main.asc_data.clear()
+    main.saved_man_files.clear()
+    main.saved_asc_files.clear()
+    main.saved_skeleton_files.clear()
+
+
+def run_benchmark(results, name, func, items, setup=None):
+    # func run REPEAT times, setup before every run is not timed
+    times = []
+    for _ in range(REPEAT):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    results[name] = {'repeat': REPEAT, 'items': items, 'min': min(times), 'median': statistics.median(times),
+                     'mean': statistics.mean(times), 'per_item_min': min(times) / max(items, 1)}
+    print(f'{name}: min {min(times) * 1000.0:.2f} ms, median {statistics.median(times) * 1000.0:.2f} ms, '
+          f'{items} items')
+
+
+def benchmark_extract(results, model_hierarchies, model_animations):
+    def parse_hierarchies():
+        for model_hierarchy in model_hierarchies:
+            main.parse_model_hierarchy(model_hierarchy)
+
+    def parse_animations():
+        for animation_name, model_animation in model_animations:
+            main.parse_model_animation(model_animation, animation_name)
+
+    def parse_all():
+        clear_main_data()
+        parse_hierarchies()
+        parse_animations()
+
+    run_benchmark(results, 'parse_model_hierarchy', parse_hierarchies, len(model_hierarchies),
+                  setup=clear_main_data)
+    run_benchmark(results, 'parse_model_animation', parse_animations, len(model_animations),
+                  setup=lambda: (clear_main_data(), parse_hierarchies()))
+
+    # resample of one .ASC sized track of every bone, like save_asc do for FPS:10 .ASC
+    track_frames = FRAMES_PER_MAN * MAN_PER_ASC
+    rng = random.Random(SEED)
+    tracks = [[random_quaternion(rng) for _ in range(track_frames)] for _ in range(max(SKELETONS.values()))]
+
+    def calc_frames_scaled():
+        for track in tracks:
+            main.calc_frames_scaled_v2(track, FPS_SOURCE, FPS_RESAMPLE)
+
+    run_benchmark(results, 'calc_frames_scaled_v2', calc_frames_scaled, len(tracks))
+
+    parse_all()
+    run_benchmark(results, 'save_man', main.save_man, len(main.model_animation_data))
+    asc_count = sum(len(folder_data) for folder_data in main.asc_data.values())
+    run_benchmark(results, 'save_asc', main.save_asc, asc_count)
+
+    output_format = main.OUTPUT_FORMAT
+    main.OUTPUT_FORMAT = 'bin'
+    try:
+        run_benchmark(results, 'save_man_bin', main.save_man, len(main.model_animation_data))
+        run_benchmark(results, 'save_asc_bin', main.save_asc, asc_count)
+    finally:
+        main.OUTPUT_FORMAT = output_format
+
+    # key reduction of resampled .ASC (not unit rotation) and of .MAN
+    key_reduction = main.KEY_REDUCTION
+    main.KEY_REDUCTION = True
+    try:
+        run_benchmark(results, 'save_man_reduced', main.save_man, len(main.model_animation_data))
+        run_benchmark(results, 'save_asc_reduced', main.save_asc, asc_count)
+    finally:
+        main.KEY_REDUCTION = key_reduction
+
+
+def load_importer():
+    # -> add-on module, None if Blender modules are not available
+    try:
+        spec = importlib.util.spec_from_file_location('import_manjson_ascjson_animation', PATH_TO_IMPORTER)
+        importer = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(importer)
+    except ImportError as error:
+        print(f'SKIP importer benchmarks: {error}')
+        return None
+
+    return importer
+
+
+def benchmark_import(results, importer):
+    from mathutils import Quaternion, Vector
+
+    anim_files = []
+    for output_format in ('json', 'bin'):
+        for folder in ('MAN', 'ASC'):
+            file = next(Path(folder).glob(f'**/*.{output_format}'))
+            anim_files.append((f'{folder.lower()}_{output_format}', file))
+
+    for name, file in anim_files:
+        def load():
+            # parse every run, not the cached result of previous one
+            importer.anim_data_cache.clear()
+            importer.load_anim_data(str(file))
+
+        def load_and_cache():
+            # file is cached by create_anim when import is done
+            load()
+            importer.cache_anim_data()
+
+        def load_cached():
+            importer.load_anim_data(str(file))
+
+        def prepare_tracks():
+            for node in importer.animation_data_dict['skeleton_data']['nodes']:
+                importer.get_bone_track(node['name'])
+
+        def convert_tracks():
+            # global to local location and euler rotation of whole tracks, without scene
+            frame_count = importer.animation_data_dict['animation_data']['frame_count']
+            for node in importer.animation_data_dict['skeleton_data']['nodes']:
+                bone_track = importer.get_bone_track(node['name'])
+                if not bone_track:
+                    continue
+                _, translation = importer.get_track_keys(bone_track, 'translation', frame_count)
+                importer.calc_bone_locations(node['name'], translation)
+                _, rotation = importer.get_track_keys(bone_track, 'rotation', frame_count)
+                importer.calc_euler_rotations(importer.calc_bone_rotations(node['name'], rotation))
+
+        def setup_convert():
+            load()
+            prepare_tracks()
+            importer.node_dict.clear()
+            for node in importer.animation_data_dict['skeleton_data']['nodes']:
+                importer.node_dict[node['name']] = {'translation': Vector([f / 100.0 for f in node['translation']]),
+                                                    'rotation': Quaternion(node['rotation'])}
+            importer.prepare_bind_poses()
+
+        run_benchmark(results, f'import_load_{name}', load, 1)
+        run_benchmark(results, f'import_load_cached_{name}', load_cached, 1, setup=load_and_cache)
+        run_benchmark(results, f'import_bone_tracks_{name}', prepare_tracks, 1, setup=load)
+        run_benchmark(results, f'import_convert_{name}', convert_tracks, 1, setup=setup_convert)
+
+
+def main_benchmark():
+    results = {}
+    model_hierarchies, model_animations = create_archive()
+
+    result_file = Path(RESULT_FILE).resolve()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as output_folder:
+        os.chdir(output_folder)
+        try:
+            benchmark_extract(results, model_hierarchies, model_animations)
+
+            # .json and .bin of every .MAN/.ASC on disk for importer
+            main.save_man()
+            main.save_asc()
+            output_format = main.OUTPUT_FORMAT
+            main.OUTPUT_FORMAT = 'bin'
+            main.save_man(clean=False)
+            main.save_asc(clean=False)
+            main.OUTPUT_FORMAT = output_format
+
+            importer = load_importer()
+            if importer:
+                benchmark_import(results, importer)
+        finally:
+            os.chdir(cwd)
+
+    report = {'python': platform.python_version(), 'platform': platform.platform(), 'numpy': np.__version__,
+              'settings': {'seed': SEED, 'skeletons': SKELETONS, 'asc_per_skeleton': ASC_PER_SKELETON,
+                           'man_per_asc': MAN_PER_ASC, 'frames_per_man': FRAMES_PER_MAN, 'repeat': REPEAT},
+              'results': results}
+    result_file.write_text(json.dumps(report, indent=4), encoding='utf-8')
+    print(f'results: {result_file}')
+
+
+if __name__ == '__main__':
+    main_benchmark()
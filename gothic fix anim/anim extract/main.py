@@ -9,6 +9,40 @@ from difflib import SequenceMatcher
 
 import shutil
 
+import multiprocessing
+
+import collections
+
+import struct
+
+import functools
+
+import hashlib
+
+import contextlib
+
+import time
+
+import tracemalloc
+
+import argparse
+
+import fnmatch
+
+import os
+
+import sys
+
+import threading
+
+import concurrent.futures
+
+import gzip
+
+import lzma
+
+import io
+
 
 # pip install zenkit
 # Luis Michaelis
@@ -16,22 +50,152 @@ import shutil
 from zenkit import Vfs, VfsOverwriteBehavior, ModelAnimation, ModelHierarchy, ModelMesh
 
 
+import numpy as np
 from scipy.interpolate import CubicSpline
 
 from mathutils import Matrix, Quaternion, Vector
 
+try:
+    # pip install zstandard, only for OUTPUT_COMPRESSION = 'zst'
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    # peak memory of PROFILE, not on windows
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    # pip install psutil, peak memory of PROFILE on windows
+    import psutil
+except ImportError:
+    psutil = None
+
 
 PATH_TO_FILE = 'C:/GAMES/Archolos GOG RUS/Data/Anims.vdf'
 
+# entry of the same name in several archives: 'newer' - file with newer date wins, 'last' - later mounted archive wins,
+# 'first' - first mounted archive wins
+MOUNT_PRECEDENCE = 'newer'
+MOUNT_CLOBBER = {'newer': VfsOverwriteBehavior.OLDER, 'last': VfsOverwriteBehavior.ALL,
+                 'first': VfsOverwriteBehavior.NONE}
+
+# not empty - extract only .MDH/.MAN added or changed against these archives (base game) and .ASC with them
+BASE_ARCHIVES = []
+
+# fnmatch globs, not case sensitive, empty include - all, command line can set them
+# skeleton: HUMANS (.MDH and .MAN of it), man: S_RUN or HUMANS-S_RUN, asc: HUM_RUN_M01 (.ASC that .MAN is made from)
+FILTERS = {'include_skeleton': [], 'exclude_skeleton': [],
+           'include_man': [], 'exclude_man': [],
+           'include_asc': [], 'exclude_asc': []}
+
+# 1 - parse .MAN files one by one, > 1 - parse .MAN files in a pool of processes
+PROCESS_COUNT = 1
+
+# 'json' - .MAN.json/.ASC.json, 'bin' - .MAN.bin/.ASC.bin (json header + float32 tracks)
+OUTPUT_FORMAT = 'json'
+
+# '' - plain files, 'gz' - .MAN.json.gz/.MAN.bin.gz, 'xz' - .xz, 'zst' - .zst (needs zstandard)
+OUTPUT_COMPRESSION = ''
+
+# '' - file per animation in MAN/ASC/SKELETON folders, 'anims.gfap' - all files in one bundle with index:
+# [magic, version, index offset, index size] [file data, ...] [json index: file path -> offset, size, ...]
+OUTPUT_BUNDLE = ''
+BUNDLE_MAGIC = b'GFAP'
+BUNDLE_VERSION = 1
+
+# .ASC resample (fps_source != fps) of rotation: 'spline' - cubic spline per component,
+# 'slerp' - spherical linear interpolation, result stay unit quaternion
+ROTATION_RESAMPLE = 'spline'
+
+BIN_MAGIC = b'GFAB'
+BIN_VERSION = 1
+
+# .bin tracks: 'float32' - raw values (BIN_VERSION), 'quantized' - uint16 per value (BIN_VERSION_QUANTIZED):
+# translation range-quantized per track, error per component <= (max - min) / 131070,
+# rotation smallest three packed in 3 x uint16, stored normalized, error < 0.01 degree
+BIN_CODEC = 'float32'
+BIN_VERSION_QUANTIZED = 2
+
+# True - skeleton_data in one SKELETON/<skeleton_name>_<checksum>.MDH.json, .MAN/.ASC have reference 'skeleton'
+SHARED_SKELETON = False
+
+# True - rebuild only changed .MDH/.MAN and .ASC with changed .MAN, state of previous run in CACHE_FILE
+INCREMENTAL = False
+CACHE_FILE = 'extract_cache.json'
+CACHE_VERSION = 1
+
+# True - write .MAN right after parse and .ASC when all it .MAN parsed, memory is bounded by the biggest .ASC
+STREAMING = False
+
+# True - time of every phase, per file times, bytes written and peak memory of process (with zenkit) and of the
+# biggest pool worker in PROFILE_FILE
+PROFILE = False
+# True - also peak of python and numpy allocations, tracemalloc slows extract several times, times are not real
+PROFILE_TRACEMALLOC = False
+PROFILE_FILE = 'extract_profile.json'
+PROFILE_SLOWEST = 20
+PROFILE_HISTOGRAM_MS = [1, 5, 10, 50, 100, 500, 1000]  # upper bounds of buckets, last bucket is for slower
+
+# 0 - write output files in main thread, > 0 - threads writing output files while parsing go on,
+# .MAN written right after parse, at most WRITER_QUEUE_SIZE files wait for write (data of them stay in memory),
+# without STREAMING all parsed .MAN stay in memory until .ASC are written, only STREAMING bounds memory
+WRITER_THREADS = 0
+WRITER_QUEUE_SIZE = 16
+
+# .ASC with frames not covered by any .MAN: 'folder/asc_name' -> missing frame ranges and .MAN segments
+ASC_GAP_REPORT_FILE = 'asc_gaps.json'
+
+# True - drop frames restorable by linear interpolation (normalized for rotation) of neighbour keys,
+# track get '<translation/rotation>_keys' with frame of every kept row, first and last frame always kept,
+# importer keys reduced rotation as quaternion also in euler mode, linear euler keys would break the tolerance
+KEY_REDUCTION = False
+KEY_TOLERANCE_TRANSLATION = 0.01  # max distance to source position, in source units (cm)
+KEY_TOLERANCE_ROTATION = 0.1  # max angle to source rotation, in degrees
+
 
 model_hierarchy_data = {}
 model_animation_data = {}
 
 asc_data = {}
 
+# written files of last save_man/save_asc: anim_name -> file info, 'folder/asc_name' -> file info
+saved_man_files = {}
+saved_asc_files = {}
+# written SKELETON/*.MDH.json files
+saved_skeleton_files = set()
+# 'folder/asc_name' -> gap report of saved .ASC with missing frames
+asc_gaps = {}
+
+# phase: {'time', 'count'}, file: {phase: time}
+profile_data = {'start': 0.0, 'phases': {}, 'files': {}, 'bytes_written': 0}
+# .active - phases running in thread
+profile_local = threading.local()
+profile_lock = threading.Lock()
+
+writer_pool = None
+# (target dict, key, future, on_done) of submitted writes, in submit order
+writer_pending = collections.deque()
+# output folders made in this run
+created_folders = set()
+
+# open OUTPUT_BUNDLE file and its index: 'entries' - .MAN/.ASC files, 'skeletons' - SKELETON/*.MDH.json files
+bundle_file = None
+bundle_index = {'entries': {}, 'skeletons': {}}
+bundle_lock = threading.Lock()
+
 
 vfs = Vfs()
-vfs.mount_disk(PATH_TO_FILE, clobber=VfsOverwriteBehavior.OLDER)
+# archives mounted to vfs, in mount order
+mounted_archives = []
+# extension ('.MDH', '.MAN', '.MDM', '.MDL', ...) -> {file_name: node}, one walk of mounted vfs
+vfs_index = {}
+
+# BASE_ARCHIVES, mounted with the same precedence
+base_vfs = Vfs()
+base_vfs_index = {}
 
 
 g_move_tr = []
@@ -40,6 +204,123 @@ v2_test = []
 bone_diff_quat_dict = {}
 
 
+@contextlib.contextmanager
+def profile_phase(phase, file_name=None):
+    # time of block to phase and file, nested block of the same phase is not counted again
+    if not PROFILE:
+        yield
+        return
+
+    if not hasattr(profile_local, 'active'):
+        profile_local.active = set()
+    if phase in profile_local.active:
+        yield
+        return
+
+    profile_local.active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        profile_local.active.discard(phase)
+
+        with profile_lock:
+            if phase not in profile_data['phases']:
+                profile_data['phases'][phase] = {'time': 0.0, 'count': 0}
+            profile_data['phases'][phase]['time'] += elapsed
+            profile_data['phases'][phase]['count'] += 1
+
+            if file_name is not None:
+                if file_name not in profile_data['files']:
+                    profile_data['files'][file_name] = {}
+                file_data = profile_data['files'][file_name]
+                file_data[phase] = file_data.get(phase, 0.0) + elapsed
+
+
+def add_bytes_written(size):
+    with profile_lock:
+        profile_data['bytes_written'] += size
+
+
+def profile_start():
+    if PROFILE:
+        if PROFILE_TRACEMALLOC:
+            tracemalloc.start()
+        profile_data['start'] = time.perf_counter()
+
+
+def merge_profile_data(profile_data_other):
+    # times of worker process
+    for phase, phase_data in profile_data_other['phases'].items():
+        if phase not in profile_data['phases']:
+            profile_data['phases'][phase] = {'time': 0.0, 'count': 0}
+        profile_data['phases'][phase]['time'] += phase_data['time']
+        profile_data['phases'][phase]['count'] += phase_data['count']
+
+    for file_name, file_data in profile_data_other['files'].items():
+        if file_name not in profile_data['files']:
+            profile_data['files'][file_name] = {}
+        for phase, elapsed in file_data.items():
+            profile_data['files'][file_name][phase] = profile_data['files'][file_name].get(phase, 0.0) + elapsed
+
+
+def get_peak_memory():
+    # -> peak resident bytes of process and of the biggest finished child process, None if not known
+    if resource is not None:
+        # kilobytes on linux, bytes on macos
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+    if psutil is not None:
+        memory_info = psutil.Process().memory_info()
+        return getattr(memory_info, 'peak_wset', None), None
+    return None, None
+
+
+def save_profile():
+    if not PROFILE:
+        return
+
+    total_time = time.perf_counter() - profile_data['start']
+    peak_memory, peak_memory_workers = get_peak_memory()
+    peak_memory_python = None
+    if PROFILE_TRACEMALLOC:
+        _, peak_memory_python = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    file_times = {file_name: sum(file_data.values()) for file_name, file_data in profile_data['files'].items()}
+
+    histogram = [{'max_ms': max_ms, 'count': 0} for max_ms in PROFILE_HISTOGRAM_MS + [None]]
+    for elapsed in file_times.values():
+        for bucket in histogram:
+            if bucket['max_ms'] is None or elapsed * 1000.0 < bucket['max_ms']:
+                bucket['count'] += 1
+                break
+
+    slowest = sorted(file_times, key=file_times.get, reverse=True)[:PROFILE_SLOWEST]
+
+    report = {'total_time': total_time,
+              'bytes_written': profile_data['bytes_written'],
+              'peak_memory': peak_memory,
+              'peak_memory_workers': peak_memory_workers,
+              'peak_memory_python': peak_memory_python,
+              'phases': profile_data['phases'],
+              'histogram': histogram,
+              'slowest': [{'file': file_name, 'time': file_times[file_name], 'phases': profile_data['files'][file_name]}
+                          for file_name in slowest],
+              'files': profile_data['files']}
+    Path(PROFILE_FILE).write_text(json.dumps(report, indent=4, ensure_ascii=False), encoding='utf-8')
+
+    print(f'PROFILE total: {total_time:.2f} s, written: {profile_data["bytes_written"]} bytes, '
+          f'peak memory: {peak_memory} bytes, workers: {peak_memory_workers} bytes, '
+          f'python: {peak_memory_python} bytes')
+    for phase, phase_data in sorted(profile_data['phases'].items(), key=lambda item: -item[1]['time']):
+        print(f'PROFILE {phase}: {phase_data["time"]:.2f} s, {phase_data["count"]} times')
+    for file_name in slowest[:5]:
+        print(f'PROFILE slow: {file_name} {file_times[file_name] * 1000.0:.1f} ms')
+
+
 def split_animation_name(animation_name):
     parts = animation_name.split('-')
     if len(parts) == 0:
@@ -129,7 +410,35 @@ def parse_model_hierarchy(model_hierarchy):
     model_hierarchy_data[model_hierarchy.checksum][skeleton_name] = skeleton_data
 
 
-def parse_model_animation(model_animation, animation_name):
+def get_asc_key(model_animation, animation_name):
+    # 'folder/asc_name' of .ASC that parse_model_animation add .MAN to, None - .MAN is not a part of .ASC
+    if model_animation.checksum not in model_hierarchy_data:
+        return None
+
+    if len(model_hierarchy_data[model_animation.checksum]) <= 0:
+        return None
+
+    source_script_data = parse_source_script(model_animation.source_script)
+    if not source_script_data or 'asc_name' not in source_script_data:
+        return None
+
+    folder, _ = split_animation_name(animation_name)
+    asc_name = str(model_animation.source_path).split('\\')[-1]
+
+    return f'{folder}/{asc_name}'
+
+
+def decode_samples(model_animation):
+    # AnimationSample is ctypes struct of 7 float32: position x, y, z, rotation w, x, y, z
+    # samples go frame by frame, in frame bone by bone in node_indices order
+    samples = model_animation.samples
+    assert model_animation.node_count * model_animation.frame_count == len(samples)
+
+    samples = np.frombuffer(b''.join([bytes(sample) for sample in samples]), dtype=np.float32)
+    return samples.reshape(model_animation.frame_count, model_animation.node_count, 7)
+
+
+def parse_model_animation(model_animation, animation_name, samples=None):
     # print('--- START parse_model_animation')
     # print(str(model_animation.source_path))
     # print(str(node.name))
@@ -166,6 +475,9 @@ def parse_model_animation(model_animation, animation_name):
 
     skeleton_name = list(model_hierarchy_data[model_animation.checksum].keys())[0]
 
+    if samples is None:
+        samples = decode_samples(model_animation)
+
     # print(f'animation {animation_name} assigned to skeleton: {model_hierarchy_data[model_animation.checksum][skeleton_name]}')
     # print(f'animation {animation_name} assigned to skeleton: {skeleton_name}')
 
@@ -206,63 +518,116 @@ def parse_model_animation(model_animation, animation_name):
             'skeleton_data': model_hierarchy_data[model_animation.checksum][skeleton_name],
             'animation_data': animation_data}
 
-    bone_offset = 0
-    frame_offset = 0
-    for sample_index, sample in enumerate(model_animation.samples):
-        if bone_offset >= len(model_animation.node_indices):
-            bone_offset = 0
-            frame_offset = frame_offset + 1
+    # one (frame_count, 3) translation and (frame_count, 4) rotation view of samples per bone
+    frames = model_animation_data[animation_name]['animation_data']['frames']
+    for bone_offset, bone_index in enumerate(model_animation.node_indices):
+        bone_name = model_hierarchy_nodes[bone_index]['name']
+        frames[bone_name] = {'translation': samples[:, bone_offset, 0:3],
+                             'rotation': samples[:, bone_offset, 3:7]}
 
-        bone_index = model_animation.node_indices[bone_offset]
 
-        bone_name = model_hierarchy_nodes[bone_index]['name']
-        if bone_name not in model_animation_data[animation_name]['animation_data']['frames']:
-            model_animation_data[animation_name]['animation_data']['frames'][bone_name] = {}
+def is_name_selected(names, filter_name):
+    # names: variants of entry name, excluded if any match exclude, selected if include is empty or any match it
+    names = [name.upper() for name in names]
+    include = [pattern.upper() for pattern in FILTERS[f'include_{filter_name}']]
+    exclude = [pattern.upper() for pattern in FILTERS[f'exclude_{filter_name}']]
 
-        # bone_index_parent = model_hierarchy_nodes[bone_index]['parent_index']
-        # bone_name_parent = ''
-        # model_animation_data[animation_name][bone_name]['parent'] = [bone_name_parent]
-        # if bone_index_parent >= 0:
-        #     bone_name_parent = model_hierarchy_nodes[bone_index_parent]['node_name']
-        #     model_animation_data[animation_name][bone_name]['parent'] = [bone_name_parent]
+    if any(fnmatch.fnmatchcase(name, pattern) for name in names for pattern in exclude):
+        return False
+    if include and not any(fnmatch.fnmatchcase(name, pattern) for name in names for pattern in include):
+        return False
 
-        # model_animation_data[animation_name][bone_name]['bone_pos'] = [model_hierarchy_nodes[bone_index]['translation']]
-        # model_animation_data[animation_name][bone_name]['bone_rot'] = [model_hierarchy_nodes[bone_index]['rotation']]
+    return True
 
-        translation = [sample.position.x, sample.position.y, sample.position.z]
-        rotation = [sample.rotation.w, sample.rotation.x, sample.rotation.y, sample.rotation.z]
 
-        if 'translation' not in model_animation_data[animation_name]['animation_data']['frames'][bone_name]:
-            model_animation_data[animation_name]['animation_data']['frames'][bone_name]['translation'] = []
-        model_animation_data[animation_name]['animation_data']['frames'][bone_name]['translation'].append(translation)
+def is_mdh_selected(mdh_name):
+    return is_name_selected([mdh_name.split('.')[0]], 'skeleton')
 
-        if 'rotation' not in model_animation_data[animation_name]['animation_data']['frames'][bone_name]:
-            model_animation_data[animation_name]['animation_data']['frames'][bone_name]['rotation'] = []
-        model_animation_data[animation_name]['animation_data']['frames'][bone_name]['rotation'].append(rotation)
 
-        bone_offset = bone_offset + 1
+def is_man_selected(man_name):
+    # HUMANS-S_RUN.MAN, skeleton and .MAN filters
+    anim_name = man_name.split('.')[0]
+    skeleton_name, _, name = anim_name.rpartition('-')
+    return is_name_selected([skeleton_name], 'skeleton') and is_name_selected([name, anim_name], 'man')
 
 
-def parse_mdh(node):
+def get_asc_name(model_animation):
+    # name of .ASC the .MAN is made from, without extension
+    return str(model_animation.source_path).split('\\')[-1].split('.')[0]
+
+
+def index_vfs_node(node, index):
     if node.is_dir():
         for node_children in node.children:
-            parse_mdh(node_children)
+            index_vfs_node(node_children, index)
     if node.is_file():
-        if node.name.endswith('.MDH'):
-            name = node.name.split('.')[0]
-            print(f'{node.name=}')
-            # if name not in ['BLOODFLY']:  # , 'DRAGON', 'DEMON', 'CRAWLER', 'HUMANS', 'BLOODFLY'
-            #     return
+        extension = Path(node.name).suffix.upper()
+        if extension not in index:
+            index[extension] = {}
+        # first node of name, as vfs.find
+        if node.name not in index[extension]:
+            index[extension][node.name] = node
 
-            print(f'{node.name=}')
-            model_hierarchy = ModelHierarchy.load(vfs.find(node.name))
-            parse_model_hierarchy(model_hierarchy)
 
+def get_vfs_index(node):
+    # built on first use, mount_archives reset it
+    if not vfs_index:
+        with profile_phase('vfs'):
+            index_vfs_node(node, vfs_index)
 
-def calc_frames_scaled_v2(frame_list, fps_source, fps):
-    fps = fps
-    frame_count = len(frame_list)
+    return vfs_index
+
+
+def find_vfs_node(file_name):
+    # index is built here when not yet, pool workers have own mount and index
+    node = get_vfs_index(vfs.root).get(Path(file_name).suffix.upper(), {}).get(file_name)
+    if node is None:
+        node = vfs.find(file_name)
+
+    return node
+
+
+def save_vfs_index(path):
+    # file names by extension, in vfs order
+    index = {'archives': mounted_archives,
+             'entries': {extension: list(entries) for extension, entries in get_vfs_index(vfs.root).items()}}
+    Path(path).write_text(json.dumps(index, indent=4, ensure_ascii=False), encoding='utf-8')
+
+
+def get_mdh_names(node):
+    mdh_names = get_vfs_index(node).get('.MDH', {})
+    return [mdh_name for mdh_name in mdh_names if is_mdh_selected(mdh_name)]
+
+
+def get_man_names(node):
+    man_names = get_vfs_index(node).get('.MAN', {})
+    return [man_name for man_name in man_names if is_man_selected(man_name)]
+
+
+def load_mdh(mdh_name):
+    name = mdh_name.split('.')[0]
+    print(f'{mdh_name=}')
+    # if name not in ['BLOODFLY']:  # , 'DRAGON', 'DEMON', 'CRAWLER', 'HUMANS', 'BLOODFLY'
+    #     return
 
+    with profile_phase('load_mdh', mdh_name):
+        model_hierarchy = ModelHierarchy.load(find_vfs_node(mdh_name))
+    with profile_phase('parse_mdh', mdh_name):
+        parse_model_hierarchy(model_hierarchy)
+
+    return model_hierarchy.checksum
+
+
+def parse_mdh(node):
+    mdh_names = get_mdh_names(node)
+
+    for mdh_name in mdh_names:
+        load_mdh(mdh_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_time_grids(frame_count, fps_source, fps):
+    # time of source frames (played with fps) and target frames (fps_source) of the same duration
     fps_target = fps_source
 
     frame_count_target = int(fps_target / fps * frame_count)
@@ -272,20 +637,169 @@ def calc_frames_scaled_v2(frame_list, fps_source, fps):
 
     time_interval_target = duration / (frame_count_target - 1)
 
-    result_frame_list = [None] * frame_count_target
-    for i in range(len(frame_list[0])):
-        y_list = [y[i] for y in frame_list]
-        x_list = [x * time_interval for x in range(len(y_list))]
-        spl = CubicSpline(x_list, y_list)
+    x = np.arange(frame_count) * time_interval
+    x_target = np.arange(frame_count_target) * time_interval_target
+
+    # shared between calls
+    x.flags.writeable = False
+    x_target.flags.writeable = False
+
+    return x, x_target
+
+
+def calc_frames_scaled_v2(frame_list, fps_source, fps):
+    x, x_target = get_time_grids(len(frame_list), fps_source, fps)
+
+    spl = CubicSpline(x, np.asarray(frame_list, dtype=np.float64), axis=0)
+    return spl(x_target)
 
-        x_target_list = [x * time_interval_target for x in range(frame_count_target)]
-        y_target_list = list(spl(x_target_list))
-        for j, y_target in enumerate(y_target_list):
-            if result_frame_list[j] is None:
-                result_frame_list[j] = []
-            result_frame_list[j].append(y_target)
 
-    return result_frame_list
+def align_rotations(rotation):
+    # q and -q is the same rotation, keep neighbour frames in one hemisphere for shortest path
+    rotation = np.array(rotation, dtype=np.float64)
+    flip = np.where(np.sum(rotation[1:] * rotation[:-1], axis=-1) < 0.0, -1.0, 1.0)
+    rotation[1:] = rotation[1:] * np.cumprod(flip, axis=0)[..., np.newaxis]
+    return rotation
+
+
+def calc_rotations_slerp(rotation, x, x_target):
+    # rotation: (frame_count, track_count, 4) w, x, y, z -> (frame_count_target, track_count, 4) unit quaternions
+    rotation = rotation / np.linalg.norm(rotation, axis=-1, keepdims=True)
+    rotation = align_rotations(rotation)
+
+    index = np.clip(np.searchsorted(x, x_target, side='right') - 1, 0, len(x) - 2)
+    t = ((x_target - x[index]) / (x[index + 1] - x[index]))[:, np.newaxis]
+
+    q0 = rotation[index]
+    q1 = rotation[index + 1]
+
+    dot = np.clip(np.sum(q0 * q1, axis=-1), -1.0, 1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+
+    # almost equal quaternions, linear interpolation
+    linear = sin_theta < 1e-6
+    sin_theta = np.where(linear, 1.0, sin_theta)
+    w0 = np.where(linear, 1.0 - t, np.sin((1.0 - t) * theta) / sin_theta)
+    w1 = np.where(linear, t, np.sin(t * theta) / sin_theta)
+
+    result = w0[..., np.newaxis] * q0 + w1[..., np.newaxis] * q1
+    return result / np.linalg.norm(result, axis=-1, keepdims=True)
+
+
+def calc_frames_scaled_batch(frames, fps_source, fps):
+    # all tracks of .ASC with equal frame count in one spline (one column per component), result back to frames
+    track_groups = {}
+    for node_name, node_data in frames.items():
+        for key, value in node_data.items():
+            value = np.asarray(value, dtype=np.float64)
+
+            method = 'spline'
+            if key == 'rotation' and ROTATION_RESAMPLE == 'slerp':
+                method = 'slerp'
+
+            group_key = (len(value), method)
+            if group_key not in track_groups:
+                track_groups[group_key] = []
+            track_groups[group_key].append((node_name, key, value))
+
+    for (frame_count, method), track_list in track_groups.items():
+        x, x_target = get_time_grids(frame_count, fps_source, fps)
+
+        if method == 'slerp':
+            rotation = np.stack([value for _, _, value in track_list], axis=1)
+            rotation_scaled = calc_rotations_slerp(rotation, x, x_target)
+            for i, (node_name, key, _) in enumerate(track_list):
+                frames[node_name][key] = rotation_scaled[:, i]
+        else:
+            y = np.concatenate([value for _, _, value in track_list], axis=1)
+            y_scaled = CubicSpline(x, y, axis=0)(x_target)
+            column = 0
+            for node_name, key, value in track_list:
+                frames[node_name][key] = y_scaled[:, column:column + value.shape[1]]
+                column = column + value.shape[1]
+
+
+def calc_track_error(restored, source, is_rotation):
+    # -> per frame distance (translation) or angle in radians (rotation, compared normalized)
+    if is_rotation:
+        restored = restored / np.linalg.norm(restored, axis=-1, keepdims=True)
+        source = source / np.linalg.norm(source, axis=-1, keepdims=True)
+        dot = np.clip(np.abs(np.sum(restored * source, axis=-1)), 0.0, 1.0)
+        return 2.0 * np.arccos(dot)
+
+    return np.linalg.norm(restored - source, axis=-1)
+
+
+def restore_track(rows, keys, frame_count):
+    # kept rows -> (frame_count, n) track, linear interpolation between keys as in importer
+    frames = np.arange(frame_count)
+    return np.column_stack([np.interp(frames, keys, rows[:, i]) for i in range(rows.shape[1])])
+
+
+def reduce_track(track, tolerance, is_rotation):
+    # track: (frame_count, 3) translation or (frame_count, 4) aligned unit rotation -> sorted indices of kept frames
+    # Douglas-Peucker: split segment at the worst frame until all frames are in tolerance
+    frame_count = len(track)
+    if frame_count <= 2:
+        return np.arange(frame_count)
+
+    keep = np.zeros(frame_count, dtype=bool)
+    keep[0] = True
+    keep[-1] = True
+
+    segments = [(0, frame_count - 1)]
+    while segments:
+        start, end = segments.pop()
+        if end - start < 2:
+            continue
+
+        t = ((np.arange(start + 1, end) - start) / (end - start))[:, np.newaxis]
+        restored = track[start] + (track[end] - track[start]) * t
+        error = calc_track_error(restored, track[start + 1:end], is_rotation)
+
+        worst = int(np.argmax(error))
+        if error[worst] > tolerance:
+            split = start + 1 + worst
+            keep[split] = True
+            segments.append((start, split))
+            segments.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def check_reduced_track(track, keys, tolerance, is_rotation):
+    # whole track rebuilt from kept keys stays in tolerance
+    error = calc_track_error(restore_track(track[keys], keys, len(track)), track, is_rotation)
+    assert error.max(initial=0.0) <= tolerance + 1e-9, f'reduced track error {error.max()} > {tolerance}'
+
+
+def reduce_frames(frames):
+    # -> frames with kept rows and '<translation/rotation>_keys' per track
+    # importer keys reduced rotation as quaternion with linear interpolation, Blender normalizes it - same as here
+    tolerance_rotation = np.radians(KEY_TOLERANCE_ROTATION)
+
+    frames_reduced = {}
+    for node_name, node_data in frames.items():
+        node_data_reduced = {}
+        if 'translation' in node_data:
+            translation = np.asarray(node_data['translation'], dtype=np.float64).reshape(-1, 3)
+            keys = reduce_track(translation, KEY_TOLERANCE_TRANSLATION, False)
+            check_reduced_track(translation, keys, KEY_TOLERANCE_TRANSLATION, False)
+            node_data_reduced['translation'] = translation[keys]
+            node_data_reduced['translation_keys'] = keys
+        if 'rotation' in node_data:
+            # kept rows in one hemisphere, linear interpolation between keys go the short way,
+            # normalized once - resampled .ASC rotation is not unit, keys are picked and kept on the same rows
+            rotation = align_rotations(np.asarray(node_data['rotation'], dtype=np.float64).reshape(-1, 4))
+            rotation = rotation / np.linalg.norm(rotation, axis=-1, keepdims=True)
+            keys = reduce_track(rotation, tolerance_rotation, True)
+            check_reduced_track(rotation, keys, tolerance_rotation, True)
+            node_data_reduced['rotation'] = rotation[keys]
+            node_data_reduced['rotation_keys'] = keys
+        frames_reduced[node_name] = node_data_reduced
+
+    return frames_reduced
 
 
 def parse_source_script(source_script):
@@ -325,85 +839,584 @@ def parse_source_script(source_script):
             'direction': direction, 'start_frame': start_frame, 'end_frame': end_frame, 'fps': fps, 'cvs': cvs}
 
 
+def load_man(man_name):
+    name = man_name.split('.')[0]
+    # if name not in ['HUMANS-S_BOWRUN']:  # HUMANS-S_BOWRUN, HUMANS-T_JUMPB, HUMANS-T_RUN_2_RUNL, HUMANS-S_RUNL, HUMANS-T_RUNL_2_RUN
+    #     return
+
+    with profile_phase('load_man', man_name):
+        model_animation = ModelAnimation.load(find_vfs_node(man_name))
+    assert model_animation.node_count == len(model_animation.node_indices)
+
+    # print(f'{model_animation.fps_source}')
+    # print(f'{model_animation.source_path}')
+    # print(f'{model_animation.source_script}')
+
+    # node name can duplicate
+    name_asc = get_asc_name(model_animation)
+    # if name_asc not in ['BARBQ_NW_MISC_SHEEP_01', ]:  # HUM_AMB_BOWRUN_M01, HUM_JUMPB_M01, HUM_RUNLOOP_M01
+    #     return
+    # .ASC name is known only after load, samples are not decoded
+    if not is_name_selected([name_asc], 'asc'):
+        return
+
+    with profile_phase('decode', man_name):
+        samples = decode_samples(model_animation)
+
+    with profile_phase('parse_man', man_name):
+        parse_model_animation(model_animation, name, samples)
+
+
+def find_skeleton_key(skeleton_data):
+    for checksum, skeleton_dict in model_hierarchy_data.items():
+        for skeleton_name, skeleton_data_other in skeleton_dict.items():
+            if skeleton_data is skeleton_data_other:
+                return checksum, skeleton_name
+
+    return None
+
+
+def init_man_worker(archive_paths, precedence, hierarchy_data, filters):
+    # worker process: own read only mount of archives, copy of parsed .MDH and filters
+    global MOUNT_PRECEDENCE
+
+    MOUNT_PRECEDENCE = precedence
+    archive_paths = list(archive_paths)
+    mounted_archives.clear()
+    mount_archives(archive_paths)
+    model_hierarchy_data.update(hierarchy_data)
+    FILTERS.update(filters)
+
+
+def parse_man_worker(man_name):
+    global model_animation_data, asc_data
+
+    model_animation_data = {}
+    asc_data = {}
+    profile_data['phases'] = {}
+    profile_data['files'] = {}
+
+    load_man(man_name)
+
+    # send skeleton as (checksum, skeleton_name), parent process have the same skeleton_data
+    for data in model_animation_data.values():
+        data['skeleton_data'] = find_skeleton_key(data['skeleton_data'])
+
+    return model_animation_data, asc_data, profile_data
+
+
+def merge_man_result(man_result):
+    man_animation_data, man_asc_data, man_profile_data = man_result
+
+    merge_profile_data(man_profile_data)
+
+    for animation_name, data in man_animation_data.items():
+        if animation_name in model_animation_data:
+            continue
+        checksum, skeleton_name = data['skeleton_data']
+        data['skeleton_data'] = model_hierarchy_data[checksum][skeleton_name]
+        model_animation_data[animation_name] = data
+
+    for folder, folder_data in man_asc_data.items():
+        if folder not in asc_data:
+            asc_data[folder] = {}
+        for asc_name, anim_data_list in folder_data.items():
+            if asc_name not in asc_data[folder]:
+                asc_data[folder][asc_name] = []
+            asc_data[folder][asc_name].extend(anim_data_list)
+
+
+def iter_parse_man(man_names):
+    # yield man_name when it data is in model_animation_data/asc_data
+    if PROCESS_COUNT > 1:
+        # results merged in order of man_names, result is the same as one by one parsing
+        # not merged results are limited, workers wait for slow consumer
+        with multiprocessing.Pool(PROCESS_COUNT, initializer=init_man_worker,
+                                  initargs=(mounted_archives, MOUNT_PRECEDENCE, model_hierarchy_data, FILTERS)) as pool:
+            pending = collections.deque()
+            for man_name in man_names:
+                pending.append((man_name, pool.apply_async(parse_man_worker, (man_name,))))
+                if len(pending) >= PROCESS_COUNT * 4:
+                    man_name_done, man_result = pending.popleft()
+                    merge_man_result(man_result.get())
+                    yield man_name_done
+            while pending:
+                man_name_done, man_result = pending.popleft()
+                merge_man_result(man_result.get())
+                yield man_name_done
+    else:
+        for man_name in man_names:
+            load_man(man_name)
+            yield man_name
+
+
+def parse_man_names(man_names):
+    for _ in iter_parse_man(man_names):
+        pass
+
+
 def parse_man(node):
-    if node.is_dir():
-        for node_children in node.children:
-            parse_man(node_children)
-    if node.is_file():
-        if node.name.endswith('.MAN'):
-            name = node.name.split('.')[0]
-            # if name not in ['HUMANS-S_BOWRUN']:  # HUMANS-S_BOWRUN, HUMANS-T_JUMPB, HUMANS-T_RUN_2_RUNL, HUMANS-S_RUNL, HUMANS-T_RUNL_2_RUN
-            #     return
-
-            model_animation = ModelAnimation.load(vfs.find(node.name))
-            assert model_animation.node_count * model_animation.frame_count == len(model_animation.samples)
-            assert model_animation.node_count == len(model_animation.node_indices)
-
-            # print(f'{model_animation.fps_source}')
-            # print(f'{model_animation.source_path}')
-            # print(f'{model_animation.source_script}')
-
-            # source_script_data = parse_source_script(model_animation.source_script)
-            # if source_script_data:
-            #     source_script_data = {**{'full_name': name}, **{'model_animation': model_animation}, **source_script_data}
-            #     asc_name = source_script_data['asc_name']
-            #     if asc_name not in asc_anim_dict:
-            #         asc_anim_dict[asc_name] = []
-            #     asc_anim_dict[asc_name].append(source_script_data)
-            # print(f'{source_script_data=}')
-
-            # node name can duplicate
-            name_asc = model_animation.source_path.split('\\')[-1].split('.')[0]
-            # if name_asc not in ['BARBQ_NW_MISC_SHEEP_01', ]:  # HUM_AMB_BOWRUN_M01, HUM_JUMPB_M01, HUM_RUNLOOP_M01
-            #     return
-
-            # node_data = parse_asc(name_asc)
-            parse_model_animation(model_animation, name)
-
-
-def save_man():
+    man_names = get_man_names(node)
+
+    parse_man_names(man_names)
+
+
+def json_default(value):
+    # tracks are numpy arrays (views of decoded samples)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# quaternion components stored for the largest one (w, x, y, z)
+QUATERNION_SMALLEST_THREE = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])
+
+
+def encode_translation(translation):
+    # (rows, 3) -> (rows, 3) uint16, [min, max] of components
+    translation = np.asarray(translation, dtype=np.float64)
+    translation_min = translation.min(axis=0)
+    translation_max = translation.max(axis=0)
+    scale = np.where(translation_max > translation_min, translation_max - translation_min, 1.0)
+
+    quantized = np.rint((translation - translation_min) / scale * 65535.0).astype('<u2')
+    return quantized, [translation_min.tolist(), translation_max.tolist()]
+
+
+def encode_rotation(rotation):
+    # (rows, 4) w, x, y, z -> (rows, 3) uint16: 15 bit per small component, index of largest in high bits
+    rotation = np.asarray(rotation, dtype=np.float64)
+    rotation = rotation / np.linalg.norm(rotation, axis=-1, keepdims=True)
+
+    rows = np.arange(len(rotation))
+    largest = np.argmax(np.abs(rotation), axis=-1)
+    # q and -q is the same rotation, largest component is always positive and not stored
+    rotation = rotation * np.where(rotation[rows, largest] < 0.0, -1.0, 1.0)[:, np.newaxis]
+
+    # other components are in [-1 / sqrt(2), 1 / sqrt(2)]
+    small = rotation[rows[:, np.newaxis], QUATERNION_SMALLEST_THREE[largest]]
+    quantized = np.rint((small * np.sqrt(2.0) + 1.0) * 0.5 * 32767.0).astype('<u2')
+    quantized[:, 0] |= ((largest & 1) << 15).astype('<u2')
+    quantized[:, 1] |= ((largest >> 1) << 15).astype('<u2')
+    return quantized
+
+
+def dumps_bin(data):
+    # [magic, version, header size, data offset] json header [translation float32 rows x 3] [rotation float32 rows x 4]
+    # bone track in header: [first row, row count], all bones of .MAN have equal row count (frame_count),
+    # reduced track have less rows and '<translation/rotation>_keys' with frame of every row
+    # BIN_CODEC 'quantized': header 'codec', rows x 3 uint16 in both blocks, bone 'translation_range' [min, max]
+    # 'skeleton_data' or 'skeleton' reference
+    header = {key: value for key, value in data.items() if key != 'animation_data'}
+    header.update({'animation_data': {}, 'bones': [], 'translation_rows': 0, 'rotation_rows': 0})
+    quantized = BIN_CODEC == 'quantized'
+    if quantized:
+        header['codec'] = BIN_CODEC
+
+    for key, value in data['animation_data'].items():
+        if key != 'frames':
+            header['animation_data'][key] = value
+
+    translation_list = []
+    rotation_list = []
+    for node_name, node_data in data['animation_data']['frames'].items():
+        bone = {'name': node_name}
+        if 'translation' in node_data:
+            translation = np.asarray(node_data['translation'], dtype=np.float32).reshape(-1, 3)
+            bone['translation'] = [header['translation_rows'], len(translation)]
+            header['translation_rows'] = header['translation_rows'] + len(translation)
+            if quantized and len(translation):
+                translation, bone['translation_range'] = encode_translation(translation)
+            translation_list.append(translation)
+        if 'rotation' in node_data:
+            rotation = np.asarray(node_data['rotation'], dtype=np.float32).reshape(-1, 4)
+            bone['rotation'] = [header['rotation_rows'], len(rotation)]
+            header['rotation_rows'] = header['rotation_rows'] + len(rotation)
+            if quantized:
+                rotation = encode_rotation(rotation)
+            rotation_list.append(rotation)
+        for key in ('translation_keys', 'rotation_keys'):
+            if key in node_data:
+                bone[key] = np.asarray(node_data[key]).tolist()
+        header['bones'].append(bone)
+
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    prefix_size = struct.calcsize('<4sIII')
+    # float32 data aligned to 16 bytes for np.frombuffer/np.memmap
+    header_bytes = header_bytes + b' ' * (-(prefix_size + len(header_bytes)) % 16)
+    data_offset = prefix_size + len(header_bytes)
+
+    dtype = '<u2' if quantized else '<f4'
+    translation_bytes = b''
+    if translation_list:
+        translation_bytes = np.concatenate(translation_list).astype(dtype).tobytes()
+    rotation_bytes = b''
+    if rotation_list:
+        rotation_bytes = np.concatenate(rotation_list).astype(dtype).tobytes()
+
+    version = BIN_VERSION_QUANTIZED if quantized else BIN_VERSION
+    prefix = struct.pack('<4sIII', BIN_MAGIC, version, len(header_bytes), data_offset)
+    return prefix + header_bytes + translation_bytes + rotation_bytes
+
+
+def make_folder(path):
+    # mkdir once per run, bundle - folders are only part of entry names
+    if OUTPUT_BUNDLE:
+        return
+
+    if path not in created_folders:
+        path.mkdir(parents=True, exist_ok=True)
+        created_folders.add(path)
+
+
+def remove_folder(path):
+    shutil.rmtree(path, ignore_errors=True)
+    created_folders.clear()
+
+
+def submit_write(target, key, func, *args, on_done=None):
+    # func(*args) in writer thread, result to target[key] (target None - result not needed), on_done() in main thread
+    # wait for the oldest write when queue is full
+    global writer_pool
+
+    if WRITER_THREADS <= 0:
+        result = func(*args)
+        if target is not None:
+            target[key] = result
+        if on_done:
+            on_done()
+        return
+
+    if writer_pool is None:
+        writer_pool = concurrent.futures.ThreadPoolExecutor(WRITER_THREADS, thread_name_prefix='writer')
+
+    writer_pending.append((target, key, writer_pool.submit(func, *args), on_done))
+    while len(writer_pending) > WRITER_QUEUE_SIZE:
+        finish_write()
+
+
+def finish_write():
+    target, key, future, on_done = writer_pending.popleft()
+    result = future.result()
+    if target is not None:
+        target[key] = result
+    if on_done:
+        on_done()
+
+
+def flush_writes():
+    while writer_pending:
+        finish_write()
+
+
+def open_bundle():
+    global bundle_file
+
+    bundle_file = open(OUTPUT_BUNDLE, 'wb')
+    # index offset and size are written in close_bundle
+    bundle_file.write(struct.pack('<4sIQI', BUNDLE_MAGIC, BUNDLE_VERSION, 0, 0))
+
+
+def add_bundle_entry(kind, name, file_data, info):
+    with bundle_lock:
+        offset = bundle_file.tell()
+        bundle_file.write(file_data)
+        bundle_index[kind][name] = {'offset': offset, 'size': len(file_data), **info}
+
+
+def close_bundle():
+    global bundle_file
+
+    # same index for same files, whatever order of writer threads
+    for kind in bundle_index:
+        bundle_index[kind] = dict(sorted(bundle_index[kind].items()))
+
+    index_bytes = json.dumps(bundle_index, ensure_ascii=False).encode('utf-8')
+    index_offset = bundle_file.tell()
+    bundle_file.write(index_bytes)
+    bundle_file.seek(0)
+    bundle_file.write(struct.pack('<4sIQI', BUNDLE_MAGIC, BUNDLE_VERSION, index_offset, len(index_bytes)))
+    bundle_file.close()
+    bundle_file = None
+
+    add_bytes_written(index_offset + len(index_bytes))
+
+
+def get_skeleton_ref(skeleton_data):
+    # write skeleton file on first use, -> reference to it
+    checksum, skeleton_name = find_skeleton_key(skeleton_data)
+
+    file = Path('SKELETON') / Path(f'{skeleton_name}_{checksum}.MDH.json')
+    with profile_lock:
+        is_new = file not in saved_skeleton_files
+        saved_skeleton_files.add(file)
+
+    if is_new:
+        skeleton_file_data = {'checksum': checksum, 'name': skeleton_name, 'skeleton_data': skeleton_data}
+        skeleton_json = json.dumps(skeleton_file_data, indent=4, ensure_ascii=False)
+        if OUTPUT_BUNDLE:
+            add_bundle_entry('skeletons', file.as_posix(), skeleton_json.encode('utf-8'), {'checksum': checksum})
+        else:
+            make_folder(file.parent)
+            file.write_text(skeleton_json, encoding='utf-8')
+            add_bytes_written(file.stat().st_size)
+
+    return {'checksum': checksum, 'name': skeleton_name, 'path': file.as_posix()}
+
+
+def clean_skeleton_folder():
+    remove_folder(Path('SKELETON'))
+    saved_skeleton_files.clear()
+
+
+def dumps_json(data):
+    return json.dumps(data, indent=4, ensure_ascii=False, default=json_default)
+
+
+def open_compressed_file(f):
+    # compressing writer to binary file object f, f stay open after close
+    if OUTPUT_COMPRESSION == 'gz':
+        # mtime=0 - same data, same file
+        return gzip.GzipFile(fileobj=f, mode='wb', mtime=0)
+    if OUTPUT_COMPRESSION == 'xz':
+        return lzma.LZMAFile(f, 'wb')
+    if OUTPUT_COMPRESSION == 'zst':
+        assert zstandard, 'pip install zstandard for OUTPUT_COMPRESSION = zst'
+        return zstandard.ZstdCompressor().stream_writer(f, closefd=False)
+
+    assert False, f'unknown OUTPUT_COMPRESSION: {OUTPUT_COMPRESSION}'
+
+
+def save_anim_file(folder, file_name, data):
+    # file_name without format extension: S_RUN.MAN, HUM_RUN_M01.ASC
+    skeleton_key = find_skeleton_key(data['skeleton_data']) if OUTPUT_BUNDLE else None
+    if SHARED_SKELETON:
+        data = {'skeleton': get_skeleton_ref(data['skeleton_data']), 'animation_data': data['animation_data']}
+
+    profile_file_name = (folder / Path(file_name)).as_posix()
+
+    if KEY_REDUCTION:
+        with profile_phase('reduce', profile_file_name):
+            animation_data = dict(data['animation_data'])
+            animation_data['frames'] = reduce_frames(animation_data['frames'])
+            data = dict(data)
+            data['animation_data'] = animation_data
+
+    # 'x' - existing file is error, without extra exists() check
+    with profile_phase('write', profile_file_name):
+        if OUTPUT_BUNDLE:
+            file_data = dumps_bin(data) if OUTPUT_FORMAT == 'bin' else dumps_json(data).encode('utf-8')
+
+            entry_data = file_data
+            if OUTPUT_COMPRESSION:
+                buffer = io.BytesIO()
+                with open_compressed_file(buffer) as f:
+                    f.write(file_data)
+                entry_data = buffer.getvalue()
+
+            file = folder / Path('.'.join(part for part in (file_name, OUTPUT_FORMAT, OUTPUT_COMPRESSION) if part))
+            animation_data = data['animation_data']
+            info = {'skeleton': skeleton_key[0] if skeleton_key else None,
+                    'fps': animation_data['fps'], 'frame_count': animation_data['frame_count']}
+            add_bundle_entry('entries', file.as_posix(), entry_data, info)
+        elif OUTPUT_COMPRESSION:
+            file_data = dumps_bin(data) if OUTPUT_FORMAT == 'bin' else dumps_json(data).encode('utf-8')
+
+            file = folder / Path(f'{file_name}.{OUTPUT_FORMAT}.{OUTPUT_COMPRESSION}')
+            with open(file, 'xb') as f_file, open_compressed_file(f_file) as f:
+                f.write(file_data)
+        elif OUTPUT_FORMAT == 'bin':
+            file = folder / Path(file_name + '.bin')
+            file_data = dumps_bin(data)
+            with open(file, 'xb') as f:
+                f.write(file_data)
+        else:
+            json_data = dumps_json(data)
+
+            file = folder / Path(file_name + '.json')
+            with open(file, 'x', encoding='utf-8') as f:
+                f.write(json_data)
+
+    size = len(entry_data) if OUTPUT_BUNDLE else file.stat().st_size
+    add_bytes_written(size)
+
+    return {'path': file.as_posix(), 'size': size}
+
+
+def save_man_entry(path_man_folder, anim_name, data):
+    skeleton_name = ''
+    man_name = anim_name + '.MAN'
+
+    anim_name_parts = anim_name.split('-')
+    if len(anim_name_parts) == 0:
+        pass
+    if len(anim_name_parts) == 2:
+        skeleton_name = anim_name_parts[0]
+        man_name = anim_name_parts[1] + '.MAN'
+    else:
+        assert False
+
+    path_man_skeleton_folder = path_man_folder
+    if skeleton_name:
+        path_man_skeleton_folder = path_man_folder / Path(skeleton_name)
+        make_folder(path_man_skeleton_folder)
+
+    return save_anim_file(path_man_skeleton_folder, man_name, data)
+
+
+def save_man(clean=True, anim_names=None):
     print(f'START SAVE MAN')
 
     path_man_folder = Path('MAN')
 
-    shutil.rmtree(path_man_folder, ignore_errors=True)
-    path_man_folder.mkdir(exist_ok=True)
+    if clean:
+        remove_folder(path_man_folder)
+        clean_skeleton_folder()
+    make_folder(path_man_folder)
+
+    saved_man_files.clear()
 
     for anim_name, data in model_animation_data.items():
-        json_data = json.dumps(data, indent=4, ensure_ascii=False)
+        if anim_names is not None and anim_name not in anim_names:
+            continue
+
+        submit_write(saved_man_files, anim_name, save_man_entry, path_man_folder, anim_name, data)
+
+    flush_writes()
+
+
+def find_asc_gaps(anim_data_list):
+    # anim_data_list sorted by start_frame -> [[first, last], ...] frames between .MAN ranges, overlaps are covered
+    gaps = []
+    covered_end = None
+    for anim_data in anim_data_list:
+        start_frame = anim_data['source_script']['start_frame']
+        end_frame = anim_data['source_script']['end_frame']
+        if covered_end is not None and start_frame > covered_end + 1:
+            gaps.append([covered_end + 1, start_frame - 1])
+        if covered_end is None or end_frame > covered_end:
+            covered_end = end_frame
+
+    return gaps
+
+
+def assemble_asc_frames(anim_data_list):
+    # one array per bone track, .MAN segments copied in order, track has rows of .MAN that have the bone
+    track_rows = {}
+    track_dtypes = {}
+    for anim_data in anim_data_list:
+        for node_name, node_data in anim_data['frames'].items():
+            for key, value in node_data.items():
+                track_rows[(node_name, key)] = track_rows.get((node_name, key), 0) + len(value)
+                if (node_name, key) not in track_dtypes:
+                    track_dtypes[(node_name, key)] = np.asarray(value).dtype
+
+    frames = {}
+    track_offsets = {}
+    for (node_name, key), rows in track_rows.items():
+        if node_name not in frames:
+            frames[node_name] = {}
+        width = 3 if key == 'translation' else 4
+        frames[node_name][key] = np.empty((rows, width), dtype=track_dtypes[(node_name, key)])
+        track_offsets[(node_name, key)] = 0
+
+    for anim_data in anim_data_list:
+        for node_name, node_data in anim_data['frames'].items():
+            for key, value in node_data.items():
+                offset = track_offsets[(node_name, key)]
+                frames[node_name][key][offset:offset + len(value)] = value
+                track_offsets[(node_name, key)] = offset + len(value)
+
+    return frames
+
+
+def save_asc_gap_report(gaps):
+    Path(ASC_GAP_REPORT_FILE).write_text(json.dumps(gaps, indent=4, ensure_ascii=False), encoding='utf-8')
+
+
+def save_asc_entry(folder_asc_path, folder_name, asc_name, anim_data_list):
+    # print(f'{asc_name=}, anim len={len(anim_data_list)}')
+    anim_data_list = sorted(anim_data_list, key=lambda item: item['source_script']['start_frame'])
+    # print(f'{anim_data_list=}')
+
+    # for anim_data in anim_data_list:
+        # print(f'man name: {anim_data["name"]}')
+
+    for i in range(len(anim_data_list)):
+        assert anim_data_list[0]['fps_source'] == anim_data_list[i]['fps_source']
+        # print(f"name={anim_data_list[i]['source_script']['name']}")
+
+    # 1, 5-10, 10-30, 30-40, Bloodfly WTF??? don't need this check???
+    gaps = find_asc_gaps(anim_data_list)
+    asc_gaps.pop(f'{folder_name}/{asc_name}', None)
+
+    # model_animation_data[animation_name]['animation_data']['frames'][bone_name]['rotation'].append(rotation)
+    assert anim_data_list[0]['name'] in model_animation_data
+
+    asc_data_to_save = {'skeleton_data': model_animation_data[anim_data_list[0]['name']]['skeleton_data'],
+                        'animation_data': {'name': asc_name,
+                                           'frame_count': 0,
+                                           'fps': anim_data_list[0]['fps_source'],
+                                           'frames': {}}}
+
+    frames = assemble_asc_frames(anim_data_list)
+
+    fps_source = anim_data_list[0]['fps_source']
+    fps = anim_data_list[0]['fps']
+    if fps_source != fps:
+        with profile_phase('resample', f'{folder_name}/{asc_name}'):
+            calc_frames_scaled_batch(frames, fps_source, fps)
+
+    asc_data_to_save['animation_data']['frames'] = frames
+    if len(frames) > 0:
+        first_node_data = list(frames.values())[0]
+        # print(f'{first_node_data=}')
+        first_key_data = list(first_node_data.values())[0]
+        # print(f'{first_key_data=}')
+        asc_data_to_save['animation_data']['frame_count'] = len(first_key_data)
+    else:
+        asc_data_to_save['animation_data']['frame_count'] = 0
 
-        skeleton_name = ''
-        man_name = anim_name + '.MAN' + '.json'
+    # bone_name = model_hierarchy_data[model_animation.checksum]['nodes'][bone_index]['node_name']
 
-        anim_name_parts = anim_name.split('-')
-        if len(anim_name_parts) == 0:
-            pass
-        if len(anim_name_parts) == 2:
-            skeleton_name = anim_name_parts[0]
-            man_name = anim_name_parts[1] + '.MAN' + '.json'
-        else:
-            assert False
+    # print(asc_anim_list[0]['model_animation'])
+    # asc_name = asc_anim_list[0]['asc_name'] + '.ASC' + '.json'
+    # asc_name = asc_name + '.ASC' + '.json'
+
+    suffix = ''
+    if gaps:
+        suffix = '_ERROR'
+        missing_frames = [frame for first, last in gaps for frame in range(first, last + 1)]
+        print(f"WARNING: Can't find .MAN file for {anim_data_list[0]['source_script']['asc_name']}.ASC, missing frames: {missing_frames}")
+        asc_gaps[f'{folder_name}/{asc_name}'] = {
+            'asc_name': anim_data_list[0]['source_script']['asc_name'],
+            'missing_frames': gaps,
+            'segments': [[anim_data['name'], anim_data['source_script']['start_frame'],
+                          anim_data['source_script']['end_frame']] for anim_data in anim_data_list]}
+
+    asc_name = anim_data_list[0]['source_script']['asc_name'] + suffix + '.ASC'
+
+    # subfolder_name, _ = split_animation_name(anim_data_list[0]['name'])
+    folder_subfolder_asc_path = folder_asc_path / Path(folder_name)
+    make_folder(folder_subfolder_asc_path)
 
-        path_man_skeleton_folder = path_man_folder
-        if skeleton_name:
-            path_man_skeleton_folder = path_man_folder / Path(skeleton_name)
-            if not path_man_skeleton_folder.exists():
-                path_man_skeleton_folder.mkdir(exist_ok=True)
+    # folder_subfolder_asc_path = folder_asc_path
 
-        file = path_man_skeleton_folder / Path(man_name)
-        if file.exists():
-            # file.unlink()
-            assert False
-        file.write_text(json_data, encoding='utf-8')
+    return save_anim_file(folder_subfolder_asc_path, asc_name, asc_data_to_save)
 
 
-def save_asc():
+def save_asc(clean=True, asc_keys=None):
     print(f'START SAVE ASC')
 
     folder_asc_path = Path('ASC')
 
-    shutil.rmtree(folder_asc_path, ignore_errors=True)
-    folder_asc_path.mkdir(exist_ok=True)
+    if clean:
+        remove_folder(folder_asc_path)
+    make_folder(folder_asc_path)
+
+    saved_asc_files.clear()
+    if clean:
+        asc_gaps.clear()
 
     # for asc_anim_name, asc_anim_list in asc_anim_dict.items():
     #     asc_anim_list = sorted(asc_anim_list, key=lambda item: item['start_frame'])
@@ -414,99 +1427,399 @@ def save_asc():
 
     for folder_name, folder_data in asc_data.items():
         for asc_name, anim_data_list in folder_data.items():
-            # print(f'{asc_name=}, anim len={len(anim_data_list)}')
-            anim_data_list = sorted(anim_data_list, key=lambda item: item['source_script']['start_frame'])
-            # print(f'{anim_data_list=}')
-
-            # for anim_data in anim_data_list:
-                # print(f'man name: {anim_data["name"]}')
-
-            for i in range(len(anim_data_list)):
-                assert anim_data_list[0]['fps_source'] == anim_data_list[i]['fps_source']
-                # print(f"name={anim_data_list[i]['source_script']['name']}")
-
-            # 1, 5-10, 10-30, 30-40, Bloodfly WTF??? don't need this check???
-            missing_frames = []
-            for i in range(len(anim_data_list)):
-                if len(anim_data_list) > 0 and i + 1 < len(anim_data_list):
-                    # assert anim_data_list[i]['source_script']['end_frame'] + 1 == anim_data_list[i + 1]['source_script']['start_frame']
-                    end_frame = anim_data_list[i]['source_script']['end_frame']
-                    start_frame = anim_data_list[i + 1]['source_script']['start_frame']
-                    if end_frame + 1 != start_frame:
-                        for frame in range(end_frame + 1, start_frame):
-                            missing_frames.append(frame)
-
-            # model_animation_data[animation_name]['animation_data']['frames'][bone_name]['rotation'].append(rotation)
-            assert anim_data_list[0]['name'] in model_animation_data
-
-            asc_data_to_save = {'skeleton_data': model_animation_data[anim_data_list[0]['name']]['skeleton_data'],
-                                'animation_data': {'name': asc_name,
-                                                   'frame_count': 0,
-                                                   'fps': anim_data_list[0]['fps_source'],
-                                                   'frames': {}}}
-
-            frames = {}
+            asc_key = f'{folder_name}/{asc_name}'
+            if asc_keys is not None and asc_key not in asc_keys:
+                continue
+
+            submit_write(saved_asc_files, asc_key, save_asc_entry, folder_asc_path, folder_name, asc_name,
+                         anim_data_list)
+
+    flush_writes()
+
+    # incremental extract has gaps of not saved .ASC in cache
+    if asc_keys is None:
+        save_asc_gap_report(asc_gaps)
+
+
+def get_entry_info(file_name):
+    data = find_vfs_node(file_name).data
+    return {'hash': hashlib.sha1(data).hexdigest(), 'size': len(data)}
+
+
+def is_output_valid(output_info):
+    if not output_info:
+        return False
+    file = Path(output_info['path'])
+    return file.exists() and file.stat().st_size == output_info['size']
+
+
+def remove_output(output_info):
+    if output_info:
+        Path(output_info['path']).unlink(missing_ok=True)
+
+
+def get_asc_membership():
+    # anim_name -> 'folder/asc_name' of parsed .MAN
+    asc_membership = {}
+    for folder, folder_data in asc_data.items():
+        for asc_name, anim_data_list in folder_data.items():
+            for anim_data in anim_data_list:
+                asc_membership[anim_data['name']] = f'{folder}/{asc_name}'
+
+    return asc_membership
+
+
+def load_cache_manifest():
+    settings = {'output_format': OUTPUT_FORMAT, 'output_compression': OUTPUT_COMPRESSION,
+                'rotation_resample': ROTATION_RESAMPLE, 'bin_codec': BIN_CODEC, 'shared_skeleton': SHARED_SKELETON,
+                'key_reduction': KEY_REDUCTION,
+                'key_tolerance': [KEY_TOLERANCE_TRANSLATION, KEY_TOLERANCE_ROTATION], 'filters': FILTERS}
+    manifest = {'version': CACHE_VERSION, 'settings': settings, 'mdh': {}, 'man': {}, 'asc': {}}
+
+    cache_file = Path(CACHE_FILE)
+    if cache_file.exists():
+        manifest_old = json.loads(cache_file.read_text(encoding='utf-8'))
+        if manifest_old.get('version') == CACHE_VERSION and manifest_old.get('settings') == settings:
+            manifest = manifest_old
+
+    return manifest
+
+
+def extract_incremental(node):
+    print(f'START INCREMENTAL EXTRACT')
+
+    manifest = load_cache_manifest()
+    if not manifest['man']:
+        # no valid cache, old output can't be matched
+        remove_folder(Path('MAN'))
+        remove_folder(Path('ASC'))
+        clean_skeleton_folder()
+
+    # .MDH always parsed (skeleton_data for .MAN), changed skeleton - rebuild all .MAN with it checksum
+    mdh_names = get_mdh_names(node)
+
+    changed_checksums = set()
+    mdh_manifest = {}
+    for mdh_name in mdh_names:
+        entry = get_entry_info(mdh_name)
+        entry['checksum'] = load_mdh(mdh_name)
+        mdh_manifest[mdh_name] = entry
+
+        entry_old = manifest['mdh'].get(mdh_name)
+        if not entry_old or entry_old['hash'] != entry['hash'] or entry_old['checksum'] != entry['checksum']:
+            changed_checksums.add(entry['checksum'])
+            if entry_old:
+                changed_checksums.add(entry_old['checksum'])
+
+    for mdh_name, entry_old in manifest['mdh'].items():
+        if mdh_name not in mdh_manifest:
+            changed_checksums.add(entry_old['checksum'])
+
+    man_names = get_man_names(node)
+
+    man_manifest = {}
+    changed_man_names = []
+    for man_name in man_names:
+        entry = get_entry_info(man_name)
+        entry_old = manifest['man'].get(man_name)
+
+        is_changed = (not entry_old or entry_old['hash'] != entry['hash'] or
+                      entry_old['checksum'] in changed_checksums or
+                      (entry_old['checksum'] is None and changed_checksums) or
+                      (entry_old['output'] and not is_output_valid(entry_old['output'])))
+        if is_changed:
+            changed_man_names.append(man_name)
+            man_manifest[man_name] = entry
+        else:
+            man_manifest[man_name] = entry_old
+
+    removed_man_names = [man_name for man_name in manifest['man'] if man_name not in man_manifest]
+
+    print(f'changed .MAN: {len(changed_man_names)}, removed .MAN: {len(removed_man_names)}, '
+          f'unchanged .MAN: {len(man_names) - len(changed_man_names)}')
+
+    parse_man_names(changed_man_names)
+
+    # .ASC with changed, new or removed .MAN, and .ASC with lost output
+    dirty_asc_keys = set(get_asc_membership().values())
+    for man_name in changed_man_names + removed_man_names:
+        entry_old = manifest['man'].get(man_name)
+        if entry_old and entry_old['asc']:
+            dirty_asc_keys.add(entry_old['asc'])
+    for asc_key, entry_old in manifest['asc'].items():
+        if not is_output_valid(entry_old['output']):
+            dirty_asc_keys.add(asc_key)
+
+    # unchanged .MAN of dirty .ASC, need data to assemble .ASC, .MAN file is not rewritten
+    changed_man_name_set = set(changed_man_names)
+    member_man_names = [man_name for man_name in man_names if man_name not in changed_man_name_set and
+                        man_manifest[man_name]['asc'] in dirty_asc_keys]
+    parse_man_names(member_man_names)
+
+    # same order as full extract, save_asc sort is stable
+    man_order = {man_name.split('.')[0]: i for i, man_name in enumerate(man_names)}
+    for folder_data in asc_data.values():
+        for anim_data_list in folder_data.values():
+            anim_data_list.sort(key=lambda item: man_order[item['name']])
+
+    for man_name in changed_man_names + removed_man_names:
+        entry_old = manifest['man'].get(man_name)
+        if entry_old:
+            remove_output(entry_old['output'])
+
+    for asc_key in dirty_asc_keys:
+        if asc_key in manifest['asc']:
+            remove_output(manifest['asc'][asc_key]['output'])
+
+    save_man(clean=False, anim_names={man_name.split('.')[0] for man_name in changed_man_names})
+    save_asc(clean=False, asc_keys=dirty_asc_keys)
+
+    asc_membership = get_asc_membership()
+    for man_name in changed_man_names:
+        anim_name = man_name.split('.')[0]
+        entry = man_manifest[man_name]
+
+        entry['checksum'] = None
+        if anim_name in model_animation_data:
+            entry['checksum'] = find_skeleton_key(model_animation_data[anim_name]['skeleton_data'])[0]
+        entry['asc'] = asc_membership.get(anim_name)
+        entry['output'] = saved_man_files.get(anim_name)
+
+    asc_manifest = {}
+    for asc_key, entry_old in manifest['asc'].items():
+        if asc_key not in dirty_asc_keys:
+            asc_manifest[asc_key] = entry_old
+    for asc_key in dirty_asc_keys:
+        if asc_key in saved_asc_files:
+            asc_manifest[asc_key] = {'output': saved_asc_files[asc_key], 'gaps': asc_gaps.get(asc_key)}
+
+    save_asc_gap_report({asc_key: entry['gaps'] for asc_key, entry in asc_manifest.items() if entry.get('gaps')})
+
+    manifest['mdh'] = mdh_manifest
+    manifest['man'] = man_manifest
+    manifest['asc'] = asc_manifest
+
+    Path(CACHE_FILE).write_text(json.dumps(manifest, indent=4, ensure_ascii=False), encoding='utf-8')
+
+
+def extract_streaming(node):
+    print(f'START STREAMING EXTRACT')
+
+    parse_mdh(node)
+
+    # .MAN count of every .ASC, samples are not decoded
+    man_names = []
+    man_asc_keys = {}
+    asc_man_count = {}
+    for man_name in get_man_names(node):
+        model_animation = ModelAnimation.load(find_vfs_node(man_name))
+        if not is_name_selected([get_asc_name(model_animation)], 'asc'):
+            continue
+        man_names.append(man_name)
+        asc_key = get_asc_key(model_animation, man_name.split('.')[0])
+        man_asc_keys[man_name] = asc_key
+        if asc_key:
+            asc_man_count[asc_key] = asc_man_count.get(asc_key, 0) + 1
+
+    # .MAN of one .ASC one after another (in archive order inside group), only one .ASC is open at a time
+    man_groups = {}
+    for man_name in man_names:
+        group_key = man_asc_keys[man_name] or man_name
+        if group_key not in man_groups:
+            man_groups[group_key] = []
+        man_groups[group_key].append(man_name)
+    man_names = [man_name for group in man_groups.values() for man_name in group]
+
+    path_man_folder = Path('MAN')
+    remove_folder(path_man_folder)
+    make_folder(path_man_folder)
+
+    folder_asc_path = Path('ASC')
+    remove_folder(folder_asc_path)
+    make_folder(folder_asc_path)
+
+    clean_skeleton_folder()
+
+    asc_man_parsed = {}
+    for man_name in iter_parse_man(man_names):
+        anim_name = man_name.split('.')[0]
+        if anim_name in model_animation_data:
+            submit_write(None, None, save_man_entry, path_man_folder, anim_name, model_animation_data[anim_name])
+
+        asc_key = man_asc_keys[man_name]
+        if not asc_key:
+            model_animation_data.pop(anim_name, None)
+            continue
+
+        asc_man_parsed[asc_key] = asc_man_parsed.get(asc_key, 0) + 1
+        if asc_man_parsed[asc_key] < asc_man_count[asc_key]:
+            continue
+
+        # all .MAN of .ASC parsed
+        folder_name, asc_name = asc_key.split('/', 1)
+        anim_data_list = asc_data[folder_name].pop(asc_name)
+
+        # .MAN data is needed until .ASC is written
+        def release_man_data(anim_data_list=anim_data_list):
             for anim_data in anim_data_list:
-                for node_name, node_data in anim_data['frames'].items():
-                    # print(f'{node_name=} {node_data=}')
-                    if node_name not in frames:
-                        frames[node_name] = {}
-                    for key, value in node_data.items():
-                        # print(f'{key=}, {value=}')
-                        if key not in frames[node_name]:
-                            frames[node_name][key] = []
-                        frames[node_name][key].extend(value)
-                        # print(f'frames after add: {len(frames[node_name][key])}')
-
-            fps_source = anim_data_list[0]['fps_source']
-            fps = anim_data_list[0]['fps']
-            for node_name, node_data in frames.items():
-                for key, value in node_data.items():
-                    if fps_source != fps:
-                        value_scaled = calc_frames_scaled_v2(value, fps_source, fps)
-                        frames[node_name][key] = value_scaled
-                        # print(f'frames after scale: {len(frames[node_name][key])}')
-
-            asc_data_to_save['animation_data']['frames'] = frames
-            if len(frames) > 0:
-                first_node_data = list(frames.values())[0]
-                # print(f'{first_node_data=}')
-                first_key_data = list(first_node_data.values())[0]
-                # print(f'{first_key_data=}')
-                asc_data_to_save['animation_data']['frame_count'] = len(first_key_data)
-            else:
-                asc_data_to_save['animation_data']['frame_count'] = 0
-
-            json_data = json.dumps(asc_data_to_save, indent=4, ensure_ascii=False)
-
-            # bone_name = model_hierarchy_data[model_animation.checksum]['nodes'][bone_index]['node_name']
-
-            # print(asc_anim_list[0]['model_animation'])
-            # asc_name = asc_anim_list[0]['asc_name'] + '.ASC' + '.json'
-            # asc_name = asc_name + '.ASC' + '.json'
-
-            suffix = ''
-            if missing_frames:
-                suffix = '_ERROR'
-                print(f"WARNING: Can't find .MAN file for {anim_data_list[0]['source_script']['asc_name']}.ASC, missing frames: {missing_frames}")
-
-            asc_name = anim_data_list[0]['source_script']['asc_name'] + suffix + '.ASC' + '.json'
-
-            # subfolder_name, _ = split_animation_name(anim_data_list[0]['name'])
-            folder_subfolder_asc_path = folder_asc_path / Path(folder_name)
-            if not folder_subfolder_asc_path.exists():
-                folder_subfolder_asc_path.mkdir(exist_ok=True)
-
-            # folder_subfolder_asc_path = folder_asc_path
-
-            file = folder_subfolder_asc_path / Path(asc_name)
-            if file.exists():
-                # file.unlink()
-                assert False
-            file.write_text(json_data, encoding='utf-8')
-
-
-parse_mdh(vfs.root)
-parse_man(vfs.root)
-save_man()
-save_asc()
+                model_animation_data.pop(anim_data['name'], None)
+
+        submit_write(None, None, save_asc_entry, folder_asc_path, folder_name, asc_name, anim_data_list,
+                     on_done=release_man_data)
+
+    flush_writes()
+    save_asc_gap_report(asc_gaps)
+
+
+def extract_pipelined(node):
+    # .MAN written by writer threads right after parse, .ASC when all .MAN parsed,
+    # parsed .MAN are kept for .ASC, memory is not bounded (STREAMING writes .ASC group by group)
+    print(f'START PIPELINED EXTRACT')
+
+    parse_mdh(node)
+
+    path_man_folder = Path('MAN')
+    remove_folder(path_man_folder)
+    clean_skeleton_folder()
+    make_folder(path_man_folder)
+
+    saved_man_files.clear()
+    for man_name in iter_parse_man(get_man_names(node)):
+        anim_name = man_name.split('.')[0]
+        if anim_name in model_animation_data:
+            submit_write(saved_man_files, anim_name, save_man_entry, path_man_folder, anim_name,
+                         model_animation_data[anim_name])
+
+    save_asc()
+
+
+def is_entry_changed(file_name):
+    # entry is added or content differs from base archives
+    base_node = base_vfs_index.get(Path(file_name).suffix.upper(), {}).get(file_name)
+    if base_node is None:
+        return True
+
+    return find_vfs_node(file_name).data != base_node.data
+
+
+def extract_differential(node):
+    print(f'START DIFFERENTIAL EXTRACT')
+
+    with profile_phase('mount'):
+        for archive_path in BASE_ARCHIVES:
+            base_vfs.mount_disk(archive_path, clobber=MOUNT_CLOBBER[MOUNT_PRECEDENCE])
+    with profile_phase('vfs'):
+        index_vfs_node(base_vfs.root, base_vfs_index)
+
+    # all .MDH are parsed (skeleton_data for .MAN), changed skeleton - all .MAN of it are changed
+    mdh_names = get_mdh_names(node)
+    changed_skeleton_names = set()
+    for mdh_name in mdh_names:
+        load_mdh(mdh_name)
+        if is_entry_changed(mdh_name):
+            changed_skeleton_names.add(mdh_name.split('.')[0])
+
+    man_names = get_man_names(node)
+    changed_man_names = set()
+    for man_name in man_names:
+        skeleton_name = man_name.split('.')[0].rpartition('-')[0]
+        if skeleton_name in changed_skeleton_names or is_entry_changed(man_name):
+            changed_man_names.add(man_name)
+
+    # .ASC of changed .MAN, .MAN of .ASC have the same skeleton, samples are not decoded
+    changed_skeleton_names.update(man_name.split('.')[0].rpartition('-')[0] for man_name in changed_man_names)
+    man_asc_keys = {}
+    for man_name in man_names:
+        if man_name.split('.')[0].rpartition('-')[0] in changed_skeleton_names:
+            model_animation = ModelAnimation.load(find_vfs_node(man_name))
+            man_asc_keys[man_name] = get_asc_key(model_animation, man_name.split('.')[0])
+
+    dirty_asc_keys = {man_asc_keys[man_name] for man_name in changed_man_names if man_asc_keys[man_name]}
+
+    print(f'changed .MAN: {len(changed_man_names)}, unchanged .MAN: {len(man_names) - len(changed_man_names)}, '
+          f'changed .ASC: {len(dirty_asc_keys)}')
+
+    # unchanged .MAN of changed .ASC are parsed for .ASC only, order is the same as full extract
+    parse_man_names([man_name for man_name in man_names if man_name in changed_man_names or
+                     man_asc_keys.get(man_name) in dirty_asc_keys])
+
+    save_man(anim_names={man_name.split('.')[0] for man_name in changed_man_names})
+    save_asc(asc_keys=dirty_asc_keys)
+    save_asc_gap_report(asc_gaps)
+
+
+def mount_archives(archive_paths):
+    for archive_path in archive_paths:
+        vfs.mount_disk(archive_path, clobber=MOUNT_CLOBBER[MOUNT_PRECEDENCE])
+        mounted_archives.append(archive_path)
+
+    # nodes of old index can be replaced by mount
+    vfs_index.clear()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='extract .MDH/.MAN of Gothic archives to .MAN/.ASC files')
+    parser.add_argument('archives', nargs='*', default=[PATH_TO_FILE],
+                        help=f'archives (.vdf/.mod) mounted in order, default: {PATH_TO_FILE}')
+    parser.add_argument('--precedence', choices=list(MOUNT_CLOBBER), default=MOUNT_PRECEDENCE,
+                        help='entry of the same name in several archives: newer file, last or first archive wins')
+    parser.add_argument('--base', action='append', default=[], metavar='ARCHIVE',
+                        help='extract only .MDH/.MAN added or changed against this archive (base game) and .ASC '
+                             'with them, can repeat')
+    parser.add_argument('-o', '--output', default='.', help='output folder, default: current folder')
+    parser.add_argument('--bundle', default=OUTPUT_BUNDLE, metavar='FILE',
+                        help='write all files to one bundle FILE in output folder (example: anims.gfap)')
+    parser.add_argument('--save-index', metavar='FILE', help='write file names of mounted archives by extension')
+    for filter_name, example in (('skeleton', 'HUMANS'), ('man', 'S_RUN'), ('asc', 'HUM_RUN_M01')):
+        parser.add_argument(f'--include-{filter_name}', action='append', default=[], metavar='GLOB',
+                            help=f'extract only matching {filter_name} names (example: {example}), can repeat')
+        parser.add_argument(f'--exclude-{filter_name}', action='append', default=[], metavar='GLOB',
+                            help=f'skip matching {filter_name} names, can repeat')
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    for filter_name in FILTERS:
+        FILTERS[filter_name] = getattr(arguments, filter_name)
+
+    MOUNT_PRECEDENCE = arguments.precedence
+    OUTPUT_BUNDLE = arguments.bundle
+    assert not (OUTPUT_BUNDLE and INCREMENTAL), 'bundle is written whole, INCREMENTAL needs file per animation'
+
+    # output paths are relative to output folder
+    archive_paths = [os.path.abspath(archive_path) for archive_path in arguments.archives]
+    BASE_ARCHIVES = [os.path.abspath(archive_path) for archive_path in arguments.base or BASE_ARCHIVES]
+    Path(arguments.output).mkdir(parents=True, exist_ok=True)
+    os.chdir(arguments.output)
+
+    profile_start()
+
+    with profile_phase('mount'):
+        mount_archives(archive_paths)
+
+    if arguments.save_index:
+        save_vfs_index(arguments.save_index)
+
+    if OUTPUT_BUNDLE:
+        open_bundle()
+
+    if BASE_ARCHIVES:
+        extract_differential(vfs.root)
+    elif INCREMENTAL:
+        extract_incremental(vfs.root)
+    elif STREAMING:
+        extract_streaming(vfs.root)
+    elif WRITER_THREADS > 0:
+        extract_pipelined(vfs.root)
+    else:
+        parse_mdh(vfs.root)
+        parse_man(vfs.root)
+        save_man()
+        save_asc()
+
+    if OUTPUT_BUNDLE:
+        close_bundle()
+
+    save_profile()
@@ -5,34 +5,417 @@ import math
 from math import pi
 import json
 from pathlib import Path
+import struct
+import re
+import io
+import gzip
+import lzma
+import collections
+
+import numpy as np
+
+try:
+    # faster json parser, optional
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    # .zst animation files, optional
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # ---
 
 import bpy
 
 from bpy.types import Operator, AddonPreferences
-from bpy.props import StringProperty, IntProperty, BoolProperty
+from bpy.props import StringProperty, IntProperty, BoolProperty, CollectionProperty
 from bpy_extras.io_utils import ImportHelper
 from bpy.types import FCurve, Camera, TimelineMarker, Object
 
 
 animation_data_dict = {}
 node_dict = {}
+# upper bone name -> {'translation': (frame_count, 3) array, 'rotation': (frame_count, 4) array}
+# not keyed bone yet: {'node_data': frames item} or {'span': (start, end) of bone json in anim_file_data}
+bone_track_dict = {}
+# raw loaded .json, bone tracks parsed from it on demand, released when no span is left
+anim_file_data = b''
+# node name -> {'inverse_matrix': (4, 4) inverse of bind matrix, 'rotation': (w, x, y, z) bind rotation}
+bind_pose_dict = {}
+# (skeleton file or bundle path, mtime, skeleton path) -> skeleton_data of shared SKELETON/*.MDH.json
+skeleton_cache = {}
+# (bundle path, mtime) -> index of .gfap bundle
+bundle_index_cache = {}
+
+# parsed files and built Actions kept for re-import in this session, least recently used are dropped
+ANIM_CACHE_SIZE = 8
+# (file path, bundle entry, mtime, size) of last loaded file
+anim_data_key = None
+# anim_data_key -> (animation_data_dict, bone_track_dict) of imported file, all bone tracks parsed, no raw .json
+anim_data_cache = collections.OrderedDict()
+# (anim_data_key, armature name, ROTATION_EULER) -> name of built Action, Action has the key in ACTION_KEY_PROPERTY
+action_cache = collections.OrderedDict()
+ACTION_KEY_PROPERTY = 'gothic_anim_key'
 
 asc_armature = None
 ROTATION_EULER = True
 
+BIN_MAGIC = b'GFAB'
+BIN_VERSION = 1
+BIN_VERSION_QUANTIZED = 2
+
+# quaternion components stored for the largest one (w, x, y, z)
+QUATERNION_SMALLEST_THREE = np.array([[1, 2, 3], [0, 2, 3], [0, 1, 3], [0, 1, 2]])
+
+# "BONE NAME": {"translation": [[...], ...], "rotation": [[...], ...]} item of "frames", bone object have only lists
+FRAMES_ITEM_RE = re.compile(rb'\s*("(?:[^"\\]|\\.)*")\s*:\s*(\{[^{}]*\})\s*,?')
+# end of "frames", "animation_data" and file
+FRAMES_END_RE = re.compile(rb'\s*\}\s*\}\s*\}\s*$')
+
+# compressed S_RUN.MAN.json.gz, S_RUN.MAN.bin.xz, ... detected by magic, extension is only for file filter
+COMPRESSION_MAGIC = {'gz': b'\x1f\x8b', 'xz': b'\xfd7zXZ\x00', 'zst': b'\x28\xb5\x2f\xfd'}
+# decompressed bytes read at once from compressed .json
+STREAM_CHUNK_SIZE = 1 << 16
+
+# .gfap: [magic, version, index offset, index size] [file data, ...] [json index]
+BUNDLE_MAGIC = b'GFAP'
+BUNDLE_VERSION = 1
+
 
 class Impp:
     def __init__(self):
         pass
 
 
-def load_anim_data(path):
-    global animation_data_dict
+def json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def index_anim_data_json(data):
+    # -> (animation_data_dict with empty frames, {bone_name: (start, end)}), None - not extractor layout, parse all
+    # extractor write "frames" as last item of "animation_data" and "animation_data" as last item of file
+    animation_data_start = data.find(b'"animation_data"')
+    if animation_data_start < 0:
+        return None
+
+    frames_start = data.find(b'"frames"', animation_data_start)
+    if frames_start < 0:
+        return None
+
+    try:
+        header = json_loads(data[:frames_start] + b'"frames": {}}}')
+    except ValueError:
+        return None
+
+    position = data.find(b'{', frames_start)
+    if position < 0:
+        return None
+    position = position + 1
+
+    bone_spans = {}
+    while True:
+        match = FRAMES_ITEM_RE.match(data, position)
+        if not match:
+            break
+        bone_spans[json_loads(match.group(1))] = match.span(2)
+        position = match.end()
+
+    if not FRAMES_END_RE.match(data, position):
+        return None
+
+    return header, bone_spans
+
+
+def is_anim_file(path):
+    # S_RUN.MAN.json, S_RUN.MAN.bin, S_RUN.MAN.json.gz, ...
+    suffixes = [suffix.lower() for suffix in Path(path).suffixes]
+    if suffixes and suffixes[-1][1:] in COMPRESSION_MAGIC:
+        suffixes.pop()
+
+    return suffixes[-1:] in (['.json'], ['.bin'])
+
+
+def is_bundle_file(path):
+    if not Path(path).is_file():
+        return False
+
+    with open(path, 'rb') as f:
+        return f.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+def load_bundle_index(path):
+    # -> {'entries': {file path: {'offset', 'size', 'skeleton', 'fps', 'frame_count'}}, 'skeletons': {file path: ...}}
+    file = Path(path).resolve()
+    bundle_key = (str(file), file.stat().st_mtime_ns)
+    if bundle_key not in bundle_index_cache:
+        with open(file, 'rb') as f:
+            prefix_size = struct.calcsize('<4sIQI')
+            magic, version, index_offset, index_size = struct.unpack('<4sIQI', read_exact(f, prefix_size))
+            assert magic == BUNDLE_MAGIC
+            assert version == BUNDLE_VERSION, f'unsupported bundle version: {version}'
+
+            f.seek(index_offset)
+            bundle_index_cache[bundle_key] = json_loads(read_exact(f, index_size))
+
+    return bundle_index_cache[bundle_key]
+
+
+def read_bundle_entry(path, kind, name):
+    # only bytes of the entry are read
+    entry = load_bundle_index(path)[kind][name]
+    with open(path, 'rb') as f:
+        f.seek(entry['offset'])
+        return read_exact(f, entry['size'])
+
+
+def open_anim_file(path, bundle_entry=None):
+    # -> (buffered stream of decompressed file data, compression: '', 'gz', 'xz', 'zst')
+    # bundle_entry - file path in .gfap bundle at path
+    if bundle_entry is None:
+        with open(path, 'rb') as f:
+            head = f.read(8)
+        source = path
+    else:
+        source = io.BytesIO(read_bundle_entry(path, 'entries', bundle_entry))
+        head = source.getvalue()[:8]
+
+    compression = ''
+    for name, magic in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            compression = name
+
+    if compression == 'gz':
+        return gzip.open(source, 'rb'), compression
+    if compression == 'xz':
+        return lzma.open(source, 'rb'), compression
+    if compression == 'zst':
+        assert zstandard, f'{Path(path).name}: pip install zstandard to import .zst files'
+        f = open(path, 'rb') if bundle_entry is None else source
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(f)), compression
+
+    if bundle_entry is None:
+        return open(path, 'rb'), compression
+    return io.BufferedReader(source), compression
+
+
+def read_exact(f, size):
+    data = f.read(size)
+    assert len(data) == size, 'unexpected end of file'
+
+    return data
+
+
+def load_anim_data_json_stream(f):
+    # compressed .json: bone tracks parsed while decompressing, text of parsed bones is dropped
+    # -> (animation_data_dict with empty frames, {bone_name: bone_track}), None - not extractor layout, parse all
+    data = bytearray()
+    while True:
+        animation_data_start = data.find(b'"animation_data"')
+        frames_start = data.find(b'"frames"', animation_data_start) if animation_data_start >= 0 else -1
+        position = data.find(b'{', frames_start) if frames_start >= 0 else -1
+        if position >= 0:
+            break
+
+        chunk = f.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return None
+        data += chunk
+
+    try:
+        header = json_loads(bytes(data[:frames_start]) + b'"frames": {}}}')
+    except ValueError:
+        return None
+
+    del data[:position + 1]
+    position = 0
+
+    bone_tracks = {}
+    end_of_file = False
+    while True:
+        match = FRAMES_ITEM_RE.match(data, position)
+        # match at the end of data can miss "," of next chunk
+        if match and (match.end() < len(data) or end_of_file):
+            bone_tracks[json_loads(match.group(1))] = parse_bone_track(json_loads(match.group(2)))
+            position = match.end()
+            continue
+
+        if end_of_file:
+            break
+
+        del data[:position]
+        position = 0
+
+        chunk = f.read(STREAM_CHUNK_SIZE)
+        end_of_file = not chunk
+        data += chunk
+
+    if not FRAMES_END_RE.match(data, position):
+        return None
+
+    return header, bone_tracks
+
+
+def decode_translation(quantized, translation_range):
+    # (rows, 3) uint16 -> (rows, 3) float64 in [min, max] of track
+    translation_min = np.asarray(translation_range[0], dtype=np.float64)
+    translation_max = np.asarray(translation_range[1], dtype=np.float64)
+    scale = np.where(translation_max > translation_min, translation_max - translation_min, 1.0)
+    return translation_min + quantized * (scale / 65535.0)
 
-    animation_data_dict = Path(path).read_text(encoding='utf-8')
-    animation_data_dict = json.loads(animation_data_dict)
+
+def decode_rotation(quantized):
+    # (rows, 3) uint16 smallest three -> (rows, 4) w, x, y, z unit quaternions
+    largest = (quantized[:, 0] >> 15) | ((quantized[:, 1] >> 15) << 1)
+    small = ((quantized & 0x7FFF) / 32767.0 * 2.0 - 1.0) / np.sqrt(2.0)
+
+    rows = np.arange(len(quantized))
+    rotation = np.empty((len(quantized), 4), dtype=np.float64)
+    rotation[rows[:, np.newaxis], QUATERNION_SMALLEST_THREE[largest]] = small
+    rotation[rows, largest] = np.sqrt(np.clip(1.0 - np.sum(small * small, axis=-1), 0.0, 1.0))
+    return rotation
+
+
+def align_rotations(rotation):
+    # q and -q is the same rotation, sign is lost in quantized track, keep neighbour rows in one hemisphere
+    flip = np.where(np.sum(rotation[1:] * rotation[:-1], axis=-1) < 0.0, -1.0, 1.0)
+    rotation[1:] = rotation[1:] * np.cumprod(flip)[:, np.newaxis]
+    return rotation
+
+
+def load_anim_data_bin(f):
+    # .MAN.bin/.ASC.bin: [magic, version, header size, data offset] json header [translation rows x 3] [rotation rows x 4]
+    # quantized: [translation rows x 3 uint16] [rotation rows x 3 uint16]
+    prefix_size = struct.calcsize('<4sIII')
+    magic, version, header_size, data_offset = struct.unpack('<4sIII', read_exact(f, prefix_size))
+    assert magic == BIN_MAGIC
+    assert version in (BIN_VERSION, BIN_VERSION_QUANTIZED), f'unsupported version: {version}'
+
+    header = json.loads(read_exact(f, header_size).decode('utf-8'))
+    # padding before data
+    read_exact(f, data_offset - prefix_size - header_size)
+    quantized = header.get('codec') == 'quantized'
+
+    if quantized:
+        dtype, rotation_size = '<u2', 3
+    else:
+        dtype, rotation_size = '<f4', 4
+
+    item_size = np.dtype(dtype).itemsize
+
+    translation_rows = header['translation_rows']
+    translation = np.frombuffer(read_exact(f, translation_rows * 3 * item_size), dtype=dtype)
+    translation = translation.reshape(translation_rows, 3)
+
+    rotation_rows = header['rotation_rows']
+    rotation = np.frombuffer(read_exact(f, rotation_rows * rotation_size * item_size), dtype=dtype)
+    rotation = rotation.reshape(rotation_rows, rotation_size)
+    if quantized:
+        rotation = decode_rotation(rotation)
+
+    frames = {}
+    for bone in header['bones']:
+        node_data = {}
+        if 'translation' in bone:
+            start, count = bone['translation']
+            node_data['translation'] = translation[start:start + count]
+            if quantized and count:
+                node_data['translation'] = decode_translation(node_data['translation'], bone['translation_range'])
+        if 'rotation' in bone:
+            start, count = bone['rotation']
+            node_data['rotation'] = rotation[start:start + count]
+            if quantized:
+                node_data['rotation'] = align_rotations(node_data['rotation'])
+        for key in ('translation_keys', 'rotation_keys'):
+            if key in bone:
+                node_data[key] = bone[key]
+        frames[bone['name']] = node_data
+
+    header['animation_data']['frames'] = frames
+
+    # 'skeleton_data' or 'skeleton' reference
+    anim_data = {key: value for key, value in header.items() if key in ('skeleton_data', 'skeleton')}
+    anim_data['animation_data'] = header['animation_data']
+
+    return anim_data
+
+
+def load_skeleton_data(path, skeleton_ref, bundle=False):
+    # skeleton_ref['path'] is relative to extractor output folder, it is one of parent folders of animation file
+    # bundle - skeleton_ref['path'] is file in .gfap bundle at path
+    if bundle:
+        file = Path(path).resolve()
+    else:
+        for folder in Path(path).resolve().parents:
+            file = folder / Path(skeleton_ref['path'])
+            if file.exists():
+                break
+        else:
+            assert False, f"skeleton file not found: {skeleton_ref['path']}"
+
+    skeleton_key = (str(file), file.stat().st_mtime_ns, skeleton_ref['path'])
+    if skeleton_key not in skeleton_cache:
+        if bundle:
+            skeleton_file_data = json_loads(read_bundle_entry(file, 'skeletons', skeleton_ref['path']))
+        else:
+            skeleton_file_data = json_loads(file.read_bytes())
+        assert skeleton_file_data['checksum'] == skeleton_ref['checksum']
+        skeleton_cache[skeleton_key] = skeleton_file_data['skeleton_data']
+
+    return skeleton_cache[skeleton_key]
+
+
+def get_anim_data_key(path, bundle_entry=None):
+    file = Path(path).resolve()
+    stat = file.stat()
+    return str(file), bundle_entry, stat.st_mtime_ns, stat.st_size
+
+
+def load_anim_data(path, bundle_entry=None):
+    global animation_data_dict, bone_track_dict, anim_file_data, anim_data_key
+
+    anim_data_key = get_anim_data_key(path, bundle_entry)
+    if anim_data_key in anim_data_cache:
+        # bone tracks parsed by previous import stay parsed
+        anim_data_cache.move_to_end(anim_data_key)
+        animation_data_dict, bone_track_dict = anim_data_cache[anim_data_key]
+        anim_file_data = b''
+        return
+
+    anim_file_data = b''
+    bone_spans = {}
+    bone_tracks = {}
+
+    f, compression = open_anim_file(path, bundle_entry)
+    with f:
+        if f.peek(len(BIN_MAGIC))[:len(BIN_MAGIC)] == BIN_MAGIC:
+            animation_data_dict = load_anim_data_bin(f)
+        elif compression:
+            # no whole decompressed text in memory, bone tracks are parsed now
+            anim_data_stream = load_anim_data_json_stream(f)
+            if anim_data_stream:
+                animation_data_dict, bone_tracks = anim_data_stream
+            else:
+                # parsed part is lost, decompress again
+                f_all, _ = open_anim_file(path, bundle_entry)
+                with f_all:
+                    animation_data_dict = json_loads(f_all.read())
+        else:
+            data = f.read()
+            anim_data_index = index_anim_data_json(data)
+            if anim_data_index:
+                animation_data_dict, bone_spans = anim_data_index
+                anim_file_data = data
+            else:
+                animation_data_dict = json_loads(data)
+
+    if 'skeleton_data' not in animation_data_dict and 'skeleton' in animation_data_dict:
+        animation_data_dict['skeleton_data'] = load_skeleton_data(path, animation_data_dict['skeleton'],
+                                                                  bundle=bundle_entry is not None)
 
     assert 'skeleton_data' in animation_data_dict
     assert 'root_translation' in animation_data_dict['skeleton_data']
@@ -45,134 +428,276 @@ def load_anim_data(path):
     assert 'fps' in animation_data_dict['animation_data']
     assert 'frames' in animation_data_dict['animation_data']
 
+    build_bone_track_index(bone_spans, bone_tracks)
 
-def get_bone_data(bone_name, frame):
-    return_list = [[], []]
+
+def cache_anim_data():
+    # after import of file: bones not keyed yet are parsed, raw .json is released by it and not cached
+    for bone_name, bone_track in list(bone_track_dict.items()):
+        if 'span' in bone_track:
+            get_bone_track(bone_name)
+
+    anim_data_cache[anim_data_key] = (animation_data_dict, bone_track_dict)
+    anim_data_cache.move_to_end(anim_data_key)
+    while len(anim_data_cache) > ANIM_CACHE_SIZE:
+        anim_data_cache.popitem(last=False)
+
+
+def build_bone_track_index(bone_spans, bone_tracks):
+    global bone_track_dict
+
+    bone_track_dict = {}
 
     for node_name, node_data in animation_data_dict['animation_data']['frames'].items():
-        if node_name.upper() == bone_name.upper():
-            if 'translation' in node_data and len(node_data['translation']) > frame:
-                return_list[0] = node_data['translation'][frame]
-            if 'rotation' in node_data and len(node_data['rotation']) > frame:
-                return_list[1] = node_data['rotation'][frame]
+        bone_track_dict[node_name.upper()] = {'node_data': node_data}
+
+    for node_name, span in bone_spans.items():
+        bone_track_dict[node_name.upper()] = {'span': span}
+
+    for node_name, bone_track in bone_tracks.items():
+        bone_track_dict[node_name.upper()] = bone_track
+
 
-    return return_list
+def parse_bone_track(node_data):
+    bone_track = {}
+    if 'translation' in node_data:
+        bone_track['translation'] = np.asarray(node_data['translation'], dtype=np.float64).reshape(-1, 3)
+    if 'rotation' in node_data:
+        bone_track['rotation'] = np.asarray(node_data['rotation'], dtype=np.float64).reshape(-1, 4)
+    # reduced tracks store the frame of every row, full tracks have a row per frame
+    for key in ('translation', 'rotation'):
+        if key + '_keys' in node_data:
+            bone_track[key + '_keys'] = np.asarray(node_data[key + '_keys'], dtype=np.int64)
 
+    return bone_track
 
-def set_animation(armature, bone_name, frame):
-    pos, rot = get_bone_data(bone_name, frame)
-    have_pos = False
-    have_rot = False
 
-    if len(pos) == 3:
-        have_pos = True
-    if len(rot) == 4:
-        have_rot = True
+def get_bone_track(bone_name):
+    # tracks of bone as arrays, parsed on first use
+    global anim_file_data
 
-    bone_name_original = bone_name
-    bone_name = bone_name.upper()
+    bone_track = bone_track_dict.get(bone_name.upper())
+    if not bone_track:
+        return None
+
+    if 'span' in bone_track:
+        start, end = bone_track.pop('span')
+        bone_track['node_data'] = json_loads(anim_file_data[start:end])
+        if not any('span' in other_track for other_track in bone_track_dict.values()):
+            anim_file_data = b''
+
+    if 'node_data' in bone_track:
+        bone_track.update(parse_bone_track(bone_track.pop('node_data')))
+
+    return bone_track
+
+
+def get_track_keys(bone_track, key, frame_count):
+    # -> (frames, rows) of track inside animation range
+    size = 3 if key == 'translation' else 4
+    if key not in bone_track:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, size))
+
+    rows = np.asarray(bone_track[key], dtype=np.float64)
+    if key + '_keys' in bone_track:
+        frames = np.asarray(bone_track[key + '_keys'], dtype=np.int64)
+    else:
+        frames = np.arange(len(rows))
+
+    inside = frames < frame_count
+    return frames[inside], rows[inside]
+
+
+def prepare_bind_poses():
+    # inverse bind matrix once per bone, tracks are converted with it as arrays
+    bind_pose_dict.clear()
+
+    for node_name, node_data in node_dict.items():
+        node_matrix_translation = Matrix.Translation(node_data['translation']).to_4x4()
+        node_matrix_rotation = node_data['rotation'].to_matrix().to_4x4()
+        node_matrix = node_matrix_translation @ node_matrix_rotation
+
+        bind_pose_dict[node_name] = {'inverse_matrix': np.array(node_matrix.inverted(), dtype=np.float64),
+                                     'rotation': np.array(node_data['rotation'], dtype=np.float64)}
+
+
+def multiply_quaternions(a, b):
+    # (n, 4) @ (4,) as mathutils Quaternion @, (w, x, y, z)
+    aw, ax, ay, az = a.T
+    bw, bx, by, bz = b
+    return np.column_stack([aw * bw - ax * bx - ay * by - az * bz,
+                            aw * bx + ax * bw + ay * bz - az * by,
+                            aw * by - ax * bz + ay * bw + az * bx,
+                            aw * bz + ax * by - ay * bx + az * bw])
+
+
+def calc_bone_locations(bone_name, translation):
+    # (n, 3) global positions -> (n, 3) local locations of bone
+    bind_pose = bind_pose_dict.get(bone_name.upper())
+    if bind_pose is None:
+        return translation
 
-    if have_pos:
-        if bone_name in node_dict and node_dict[bone_name]:
-            pos = Vector([f / 100.0 for f in pos])
+    # convert global coordinate to local, frame rotation doesn't affect translation
+    inverse_matrix = bind_pose['inverse_matrix']
+    location = (translation / 100.0) @ inverse_matrix[:3, :3].T + inverse_matrix[:3, 3]
 
-            node_matrix_translation = Matrix.Translation(node_dict[bone_name]['translation']).to_4x4()
-            node_matrix_rotation = node_dict[bone_name]['rotation'].to_matrix().to_4x4()
-            node_matrix = node_matrix_translation @ node_matrix_rotation
+    # [-z, x, y]
+    return np.column_stack([-location[:, 2], location[:, 0], location[:, 1]])
 
-            frame_matrix_translation = Matrix.Translation(pos).to_4x4()
-            frame_matrix_rotation = Quaternion(rot).to_matrix().to_4x4()
-            frame_matrix = frame_matrix_translation @ frame_matrix_rotation
 
-            # convert global coordinate to local
-            m1 = node_matrix.inverted() @ frame_matrix
-            pos = m1.to_translation()
-            pos = Vector([-pos.z, pos.x, pos.y])
+def calc_bone_rotations(bone_name, rotation):
+    # (n, 4) rotations -> (n, 4) rotation quaternions of bone
+    bind_pose = bind_pose_dict.get(bone_name.upper())
+    if bind_pose is not None:
+        rotation = multiply_quaternions(rotation, bind_pose['rotation'])
 
-        # print(f'rot in pos calc: {get_euler_string(m1)}')
+    # [w, -z, x, y]
+    return np.column_stack([rotation[:, 0], -rotation[:, 3], rotation[:, 1], rotation[:, 2]])
 
-    rot_quat = Quaternion()
-    if have_rot:
-        rot_quat = Quaternion(rot)
 
-        if bone_name in node_dict and node_dict[bone_name] and 'rotation' in node_dict[bone_name]:
-            rot_quat = rot_quat @ node_dict[bone_name]['rotation']
+def calc_euler_rotations(rotation):
+    # (n, 4) quaternions -> (n, 3) XYZ euler, first key as Quaternion.to_euler(), next keys compatible with previous
+    rotation = rotation / np.linalg.norm(rotation, axis=1, keepdims=True) * math.sqrt(2.0)
+    w, x, y, z = rotation.T
 
-        rot_quat = Quaternion(Vector([rot_quat.w, -rot_quat.z, rot_quat.x, rot_quat.y]))
+    # rotation matrix, m_ij - column i, row j as in Blender
+    m00 = 1.0 - y * y - z * z
+    m01 = w * z + x * y
+    m02 = x * z - w * y
+    m11 = 1.0 - x * x - z * z
+    m12 = w * x + y * z
+    m21 = y * z - w * x
+    m22 = 1.0 - x * x - y * y
+    cy = np.hypot(m00, m01)
 
-    animation_data = armature.animation_data
+    # both euler of the rotation, same one at gimbal lock
+    euler = np.stack([np.column_stack([np.arctan2(m12, m22), np.arctan2(-m02, cy), np.arctan2(m01, m00)]),
+                      np.column_stack([np.arctan2(-m12, -m22), np.arctan2(-m02, -cy), np.arctan2(-m01, -m00)])],
+                     axis=1)
+    gimbal = cy <= 16.0 * np.finfo(np.float32).eps
+    euler[gimbal, 0] = np.column_stack([np.arctan2(-m21, m11), np.arctan2(-m02, cy), np.zeros(len(cy))])[gimbal]
+    euler[gimbal, 1] = euler[gimbal, 0]
 
-    if ROTATION_EULER:
-        curve_path_pos = f'pose.bones["{bone_name_original}"].location'
-        curve_path_rot = f'pose.bones["{bone_name_original}"].rotation_euler'
+    if not len(euler):
+        return np.zeros((0, 3))
 
-        curve_pos = [None, None, None]
-        curve_rot = [None, None, None]
+    # [key, euler of key, euler of previous key] -> distance, angles compared modulo turn
+    delta = euler[1:, :, None, :] - euler[:-1, None, :, :]
+    distance = np.abs((delta + pi) % (2.0 * pi) - pi).sum(axis=3)
+    nearest = np.argmin(distance, axis=1).tolist()
 
-        for fc in animation_data.action.fcurves:
-            if fc.data_path == curve_path_pos:
-                curve_pos[fc.array_index] = fc
-            elif fc.data_path == curve_path_rot:
-                curve_rot[fc.array_index] = fc
+    # chain of nearest euler from first key, then every angle shifted by turns to previous key
+    branch = [int(np.abs(euler[0, 0]).sum() > np.abs(euler[0, 1]).sum())]
+    for nearest_key in nearest:
+        branch.append(nearest_key[branch[-1]])
 
-        if have_pos:
-            for i in range(len(curve_pos)):
-                if not curve_pos[i]:
-                    curve_pos[i] = animation_data.action.fcurves.new(curve_path_pos, index=i, action_group=bone_name_original)
-                curve_pos[i].keyframe_points.insert(frame, pos[i])
+    return np.unwrap(euler[np.arange(len(euler)), branch], axis=0)
 
-        if have_rot:
-            rot_euler = rot_quat.to_euler()
 
-            for i in range(len(curve_rot)):
-                if curve_rot[i] is None:
-                    curve_rot[i] = animation_data.action.fcurves.new(curve_path_rot, index=i, action_group=bone_name_original)
-                curve_rot[i].keyframe_points.insert(frame, rot_euler[i])
+def set_fcurve_keys(action, data_path, index, action_group, frames, values, interpolation='BEZIER'):
+    # all keyframes of curve at once, same result as keyframe_points.insert per frame
+    fcurve = action.fcurves.find(data_path, index=index)
+    if fcurve is None:
+        fcurve = action.fcurves.new(data_path, index=index, action_group=action_group)
+
+    keyframe_points = fcurve.keyframe_points
+    count_old = len(keyframe_points)
+
+    co_old = np.zeros(count_old * 2, dtype=np.float32)
+    keyframe_points.foreach_get('co', co_old)
+    co = np.concatenate([co_old, np.column_stack([frames, values]).astype(np.float32).ravel()])
+
+    keyframe_points.add(len(frames))
+    keyframe_points.foreach_set('co', co)
+
+    interpolation = bpy.types.Keyframe.bl_rna.properties['interpolation'].enum_items[interpolation].value
+    keyframe_points.foreach_set('interpolation', [interpolation] * len(keyframe_points))
+
+    fcurve.update()
+
+
+def is_euler_bone(bone_name):
+    # reduced rotation is error bounded for linear interpolation of quaternion (Blender normalizes it),
+    # linear interpolation of euler keys is other path, so such bone stay in quaternion mode
+    bone_track = get_bone_track(bone_name)
+    return ROTATION_EULER and not (bone_track and 'rotation_keys' in bone_track)
+
+
+def set_animation(armature, bone_name, frame_count):
+    bone_track = get_bone_track(bone_name)
+    if not bone_track:
+        return
+
+    # whole tracks are converted before fcurves, keys are only copied to them
+    frames_pos, values_pos = get_track_keys(bone_track, 'translation', frame_count)
+    values_pos = calc_bone_locations(bone_name, values_pos)
+
+    frames_rot, values_rot = get_track_keys(bone_track, 'rotation', frame_count)
+    values_rot = calc_bone_rotations(bone_name, values_rot)
+    rotation_euler = is_euler_bone(bone_name)
+    if rotation_euler:
+        values_rot = calc_euler_rotations(values_rot)
+
+    # reduced tracks are error bounded for linear interpolation between keys
+    interpolation_pos = 'LINEAR' if 'translation_keys' in bone_track else 'BEZIER'
+    interpolation_rot = 'LINEAR' if 'rotation_keys' in bone_track else 'BEZIER'
+
+    action = armature.animation_data.action
+
+    curve_path_pos = f'pose.bones["{bone_name}"].location'
+    if rotation_euler:
+        curve_path_rot = f'pose.bones["{bone_name}"].rotation_euler'
+        rot_size = 3
     else:
-        curve_path_pos = f'pose.bones["{bone_name_original}"].location'
-        curve_path_rot = f'pose.bones["{bone_name_original}"].rotation_quaternion'
+        curve_path_rot = f'pose.bones["{bone_name}"].rotation_quaternion'
+        rot_size = 4
+
+    if len(frames_pos):
+        for i in range(3):
+            set_fcurve_keys(action, curve_path_pos, i, bone_name, frames_pos, values_pos[:, i], interpolation_pos)
+
+    if len(frames_rot):
+        for i in range(rot_size):
+            set_fcurve_keys(action, curve_path_rot, i, bone_name, frames_rot, values_rot[:, i], interpolation_rot)
+
 
-        curve_pos = [None, None, None]
-        curve_rot = [None, None, None, None]
+def build_node_index(nodes):
+    # node name -> parent name, node name -> child names in order of nodes
+    node_parent_dict = {}
+    node_children_dict = {}
 
-        for fc in animation_data.action.fcurves:
-            if fc.data_path == curve_path_pos:
-                curve_pos[fc.array_index] = fc
-            elif fc.data_path == curve_path_rot:
-                curve_rot[fc.array_index] = fc
+    for node in nodes:
+        node_children_dict[node['name']] = []
 
-        if have_pos:
-            for i in range(len(curve_pos)):
-                if not curve_pos[i]:
-                    curve_pos[i] = animation_data.action.fcurves.new(curve_path_pos, index=i, action_group=bone_name_original)
-                curve_pos[i].keyframe_points.insert(frame, pos[i])
+    for node in nodes:
+        parent_index = node['parent_index']
+        if parent_index >= 0:
+            parent_name = nodes[parent_index]['name']
+            node_parent_dict[node['name']] = parent_name
+            node_children_dict[parent_name].append(node['name'])
 
-        if have_rot:
-            for i in range(len(curve_rot)):
-                if curve_rot[i] is None:
-                    curve_rot[i] = animation_data.action.fcurves.new(curve_path_rot, index=i, action_group=bone_name_original)
-                curve_rot[i].keyframe_points.insert(frame, rot_quat[i])
+    return node_parent_dict, node_children_dict
 
 
 def create_skeleton():
     global asc_armature
 
+    node_parent_dict, node_children_dict = build_node_index(animation_data_dict['skeleton_data']['nodes'])
+
     def get_parent_node_data(node_name):
-        for n_name, n_data in node_dict.items():
-            if node_name == n_name:
-                if n_data['parent_name'] and n_data['parent_name'] in node_dict:
-                    return node_dict[n_data['parent_name']]
+        parent_name = node_parent_dict.get(node_name)
+        if parent_name and parent_name in node_dict:
+            return node_dict[parent_name]
 
         return None
 
     def get_child_node_data(node_name, tag=None):
-        for n_name, n_data in node_dict.items():
-            if node_name == n_data['parent_name']:
-                if tag:
-                    if tag in n_name:
-                        return n_data
-                else:
-                    return n_data
+        for child_name in node_children_dict.get(node_name, []):
+            if tag:
+                if tag in child_name:
+                    return node_dict[child_name]
+            else:
+                return node_dict[child_name]
 
         return None
 
@@ -257,6 +782,8 @@ def create_skeleton():
         node_dict[name] = {'parent_name': parent_name, 'translation': translation, 'rotation': rotation,
                            'transform_translation': transform_translation, 'transform_rotation': transform_rotation,
                            'transform_matrix': transform_matrix}
+
+    prepare_bind_poses()
     #
     #     min_pos_y = min(transform_pos.y, min_pos_y)
     #
@@ -299,10 +826,9 @@ def create_skeleton():
                     bone.length = parent_node_data['bone'].length / 2
 
             node_dict[node_name]['bone'] = bone
-            if 'parent_name' in node_dict[node_name] and node_dict[node_name]['parent_name']:
-                parent_name = node_dict[node_name]['parent_name']
-                if 'bone' in node_dict[parent_name]:
-                    bone.parent = node_dict[parent_name]['bone']
+            parent_node_data = get_parent_node_data(node_name)
+            if parent_node_data and 'bone' in parent_node_data:
+                bone.parent = parent_node_data['bone']
 
     for node_name, node_data in node_dict.items():
         # if 'BIP01' not in node_name:
@@ -343,7 +869,32 @@ def create_skeleton():
         bpy.ops.object.mode_set(mode='OBJECT', toggle=False)
 
 
-def create_anim():
+def get_cached_action(action_key):
+    # -> Action built for action_key, None - not built or removed (undo, user)
+    action_name = action_cache.get(action_key)
+    action = bpy.data.actions.get(action_name) if action_name else None
+    if action is None or action.get(ACTION_KEY_PROPERTY) != str(action_key):
+        action_cache.pop(action_key, None)
+        return None
+
+    action_cache.move_to_end(action_key)
+    return action
+
+
+def cache_action(action_key, action):
+    action[ACTION_KEY_PROPERTY] = str(action_key)
+    action_cache[action_key] = action.name
+
+    # Action without users is kept by Blender until file is saved and reopened, dropped ones are removed now
+    while len(action_cache) > ANIM_CACHE_SIZE:
+        _, action_name = action_cache.popitem(last=False)
+        action = bpy.data.actions.get(action_name)
+        if action and action.users == 0:
+            bpy.data.actions.remove(action)
+
+
+def create_anim(nla=False):
+    # nla: new action named as animation, pushed down to own NLA track, previous actions stay
     frame_count = animation_data_dict['animation_data']['frame_count']
     assert frame_count >= 1
 
@@ -352,7 +903,10 @@ def create_anim():
     scene = bpy.context.scene
     scene.render.fps = int(animation_data_dict['animation_data']['fps'])
     scene.frame_start = 0
-    scene.frame_end = frame_count - 1
+    if nla:
+        scene.frame_end = max(scene.frame_end, frame_count - 1)
+    else:
+        scene.frame_end = frame_count - 1
     scene.frame_set(0)
 
     for obj in bpy.context.scene.objects:
@@ -366,21 +920,45 @@ def create_anim():
         if animation_data is None:
             animation_data = obj.animation_data_create()
 
-        if animation_data.action:
-            bpy.data.actions.remove(animation_data.action, do_unlink=True)
+        # same file imported again to same armature - Action built before is only assigned
+        action_key = (anim_data_key, obj.name, ROTATION_EULER)
+        action = get_cached_action(action_key)
+        is_cached = action is not None
 
-        animation_data.action = bpy.data.actions.new(f'{obj.name}Action')
+        if nla:
+            if not is_cached:
+                action = bpy.data.actions.new(animation_data_dict['animation_data']['name'])
+        else:
+            # cached Actions stay for next import
+            if animation_data.action and animation_data.action.name not in action_cache.values():
+                bpy.data.actions.remove(animation_data.action, do_unlink=True)
+
+            if not is_cached:
+                action = bpy.data.actions.new(f'{obj.name}Action')
+        animation_data.action = action
+
+        for pose_bone in obj.pose.bones:
+            bone_name = pose_bone.name
+            # print(f'{pose_bone=}')
+            if is_euler_bone(bone_name):
+                pose_bone.rotation_mode = 'XYZ'
+            else:
+                pose_bone.rotation_mode = 'QUATERNION'
+            if not is_cached:
+                set_animation(obj, bone_name, frame_count)
 
-        for frame in range(frame_count):
-            # print(f'{frame=}')
-            for pose_bone in obj.pose.bones:
-                bone_name = pose_bone.name
-                # print(f'{pose_bone=}')
-                if ROTATION_EULER:
-                    pose_bone.rotation_mode = 'XYZ'
-                else:
-                    pose_bone.rotation_mode = 'QUATERNION'
-                set_animation(obj, bone_name, frame)
+        if not is_cached:
+            cache_action(action_key, action)
+
+        if nla:
+            # cached Action can be named by armature
+            anim_name = animation_data_dict['animation_data']['name']
+            track = animation_data.nla_tracks.new()
+            track.name = anim_name
+            track.strips.new(anim_name, 0, action)
+            animation_data.action = None
+
+    cache_anim_data()
 
 
 def reset_scene():
@@ -420,21 +998,73 @@ class Pref(AddonPreferences):
         layout.prop(self, 'boolean')
 
 
+def search_bundle_entries(self, context, edit_text):
+    # animations of .gfap bundle selected in file browser
+    if not is_bundle_file(self.filepath):
+        return []
+
+    entries = load_bundle_index(self.filepath)['entries']
+    return [(name, f"{entry['frame_count']} frames, {entry['fps']:g} fps") for name, entry in entries.items()
+            if edit_text.upper() in name.upper()]
+
+
 class Import_MANJSON_ASCJSON_Animation(Operator, ImportHelper):
     bl_idname = 'import.import_manjson_ascjson_animation'
     bl_label = '.MAN.json | .ASC.json'
     bl_options = {'REGISTER', 'UNDO', 'PRESET'}
     filename_ext = '.json'
     filter_glob: StringProperty(
-        default='*.json',
+        default='*.json;*.bin;*.gz;*.xz;*.zst;*.gfap',
         options={'HIDDEN'},
     )
+    files: CollectionProperty(
+        type=bpy.types.OperatorFileListElement,
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+    directory: StringProperty(
+        subtype='DIR_PATH',
+        options={'HIDDEN', 'SKIP_SAVE'},
+    )
+    import_folder: BoolProperty(
+        name='Whole folder',
+        description='Import all .MAN/.ASC files of the folder, every animation to own NLA track',
+        default=False,
+    )
+
+    bundle_entry: StringProperty(
+        name='Animation',
+        description='Animation of selected .gfap bundle, empty - all animations of bundle',
+        search=search_bundle_entries,
+    )
+
+    def get_paths(self):
+        # -> [(path, bundle_entry)], bundle_entry None - path is animation file
+        directory = Path(self.directory) if self.directory else Path(self.filepath).parent
+
+        if self.import_folder:
+            paths = sorted(str(path) for path in directory.iterdir() if path.is_file() and is_anim_file(path))
+        else:
+            paths = [str(directory / file.name) for file in self.files if file.name]
+            if not paths:
+                paths = [self.filepath]
+
+        anim_paths = []
+        for path in paths:
+            if is_bundle_file(path):
+                bundle_entries = [self.bundle_entry] if self.bundle_entry else list(load_bundle_index(path)['entries'])
+                anim_paths.extend((path, bundle_entry) for bundle_entry in bundle_entries)
+            else:
+                anim_paths.append((path, None))
+
+        return anim_paths
 
     def execute(self, context):
-        global animation_data_dict, node_dict, asc_armature, ROTATION_EULER
+        global animation_data_dict, node_dict, bone_track_dict, anim_file_data, asc_armature, ROTATION_EULER
 
         animation_data_dict = {}
         node_dict = {}
+        bone_track_dict = {}
+        anim_file_data = b''
         asc_armature = None
 
         preferences = context.preferences
@@ -443,16 +1073,41 @@ class Import_MANJSON_ASCJSON_Animation(Operator, ImportHelper):
 
         print(f'{ROTATION_EULER=}')
 
-        # reset_scene()
-        load_anim_data(self.filepath)
-        create_skeleton()
-        create_anim()
+        paths = self.get_paths()
+        if not paths:
+            self.report({'ERROR'}, 'No animation files')
+            return {'CANCELLED'}
+
+        if len(paths) == 1:
+            # reset_scene()
+            load_anim_data(*paths[0])
+            create_skeleton()
+            create_anim()
+
+            return {'FINISHED'}
+
+        # skeleton and node_dict from first file, every file is own action in NLA
+        # scene end is the end of the longest animation
+        context.scene.frame_end = 0
+
+        skeleton_source_path = None
+        for path, bundle_entry in paths:
+            load_anim_data(path, bundle_entry)
+
+            if skeleton_source_path is None:
+                skeleton_source_path = animation_data_dict['skeleton_data']['source_path']
+                create_skeleton()
+            elif animation_data_dict['skeleton_data']['source_path'] != skeleton_source_path:
+                self.report({'WARNING'}, f'{bundle_entry or Path(path).name} skipped, other skeleton')
+                continue
+
+            create_anim(nla=True)
 
         return {'FINISHED'}
 
 
 def menu_func_import(self, context):
-    self.layout.operator(Import_MANJSON_ASCJSON_Animation.bl_idname, text='Gothic Animation (.MAN.json) (.ASC.json)')
+    self.layout.operator(Import_MANJSON_ASCJSON_Animation.bl_idname, text='Gothic Animation (.MAN.json) (.ASC.json) (.bin) (.gfap)')
 
 
 def register():